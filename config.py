@@ -20,9 +20,30 @@ DB_PATH = os.getenv("DB_PATH", "chat_summarizer.db")
 # URI для подключения к базе данных
 DATABASE_URI = f"sqlite:///{DB_PATH}"
 
+# Параметры пула соединений с БД
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
 # Минимальное количество сообщений для создания саммари
 MIN_MESSAGES = int(os.getenv("MIN_MESSAGES", "5"))
 
+# Размер пачки сообщений, при котором буфер сразу записывается в БД
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200"))
+
+# Максимальное время (в секундах) между записями буфера сообщений в БД
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.5"))
+
+# Максимальное число сообщений в очереди на запись; при переполнении обработчики ждут
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "10000"))
+
+# Время жизни (в секундах) кэша статистики чата
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "60"))
+
+# Время (в секундах), в течение которого неизменившиеся чаты и пользователи не перезаписываются в БД
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", "300"))
+
 # API-ключ Yandex GPT
 YANDEX_GPT_API_KEY = os.getenv("YANDEX_GPT_API_KEY", "YOUR_YANDEX_GPT_API_KEY")
 
@@ -35,6 +56,7 @@ YANDEX_GPT_MODEL = os.getenv("YANDEX_GPT_MODEL", "yandexgpt-lite")
 # Настройки повторных попыток для БД (можно добавить, если нужно)
 RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
 RETRY_DELAY = int(os.getenv("RETRY_DELAY", "1"))
+RETRY_MAX_DELAY = int(os.getenv("RETRY_MAX_DELAY", "30"))
 
 # Параметры логирования
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -1,153 +1,440 @@
 import logging
+import time
+import threading
+from functools import lru_cache
+from collections import defaultdict
+from collections.abc import Iterable
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload, raiseload, load_only
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from sqlalchemy import update, delete, select, and_, desc
+from sqlalchemy import update, delete, insert, select, and_, or_, desc, bindparam, func, tuple_, event
+from sqlalchemy import Table, MetaData, Column, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from models import Chat, User, Message, Reaction, Summary
-from database import SessionLocal # Using session factory
+from database import SessionLocal, ScopedSession # Using session factory
+from config import STATS_CACHE_TTL, ENTITY_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
+# Messages for summarization come with author and chat loaded up front;
+# any other relationship access raises instead of issuing a query per message
+SUMMARY_LOAD_OPTIONS = (selectinload(Message.user), selectinload(Message.chat), raiseload('*'))
+
+# Unsummarized messages only feed the summarizer, so only the columns it reads are loaded;
+# raw_data, entities, forward and media ids stay in the DB
+UNSUMMARIZED_LOAD_OPTIONS = (
+    load_only(
+        Message.message_id, Message.chat_id, Message.user_id, Message.date_ts, Message.text, Message.caption,
+        Message.message_thread_id, Message.media_type, Message.has_media, Message.is_question, Message.summarized
+    ),
+    *SUMMARY_LOAD_OPTIONS,
+)
+
+# Longer id lists are passed to UPDATE through a temp table instead of an IN (...) list
+MARK_SUMMARIZED_TEMP_TABLE_THRESHOLD = 500
+
+# Per-connection scratch table for mark_messages_as_summarized; emptied before each commit
+_summarized_ids = Table(
+    '_summarized_ids', MetaData(),
+    Column('id', Integer, primary_key=True),
+    prefixes=['TEMPORARY'],
+    sqlite_with_rowid=False,
+)
+
+# Telegram unix timestamp -> local datetime; messages of a batch mostly share a handful of seconds
+_from_timestamp = lru_cache(maxsize=4096)(datetime.fromtimestamp)
+
+# Hot-path statements are built once; values are passed as bind parameters
+_GET_MESSAGE_STMT = select(Message).where(
+    Message.chat_id == bindparam('chat_id'),
+    Message.message_id == bindparam('message_id'),
+)
+_UNSUMMARIZED_MESSAGES_STMT = (
+    select(Message)
+    .options(*UNSUMMARIZED_LOAD_OPTIONS)
+    .where(Message.chat_id == bindparam('chat_id'), Message.summarized == False)
+    .order_by(Message.date_ts.asc(), Message.internal_id.asc()) # From old to new for summarization
+    .limit(bindparam('limit'))
+)
+_UNSUMMARIZED_SINCE_CLAUSE = Message.date_ts >= bindparam('since')
+# Keyset pagination: continue right after the last (date_ts, internal_id) of the previous page
+_UNSUMMARIZED_AFTER_CLAUSE = (
+    tuple_(Message.date_ts, Message.internal_id)
+    > tuple_(bindparam('after_date_ts', type_=Message.date_ts.type), bindparam('after_id', type_=Message.internal_id.type))
+)
+_UNSUMMARIZED_MESSAGES_SINCE_STMT = _UNSUMMARIZED_MESSAGES_STMT.where(_UNSUMMARIZED_SINCE_CLAUSE)
+_UNSUMMARIZED_MESSAGES_AFTER_STMT = _UNSUMMARIZED_MESSAGES_STMT.where(_UNSUMMARIZED_AFTER_CLAUSE)
+_UNSUMMARIZED_MESSAGES_SINCE_AFTER_STMT = _UNSUMMARIZED_MESSAGES_SINCE_STMT.where(_UNSUMMARIZED_AFTER_CLAUSE)
+_MESSAGE_EXISTS_STMT = select(
+    select(Message.internal_id)
+    .where(Message.chat_id == bindparam('chat_id'), Message.message_id == bindparam('message_id'))
+    .exists()
+)
+_MESSAGES_BULK_STMT = select(Message).where(
+    Message.chat_id == bindparam('chat_id'),
+    Message.message_id.in_(bindparam('message_ids', expanding=True)),
+)
+_ACTIVE_CHAT_IDS_STMT = select(Chat.chat_id).where(Chat.is_active == True)
+_LATEST_SUMMARY_STMT = (
+    select(Summary)
+    .where(Summary.chat_id == bindparam('chat_id'))
+    .order_by(Summary.created_ts.desc(), Summary.id.desc()) # Newest id first on equal timestamps
+    .limit(1)
+)
+# Chat existence and all counters in one pass over the chat's messages
+_CHAT_STATS_STMT = select(
+    select(Chat.chat_id).where(Chat.chat_id == bindparam('chat_id')).exists().label('chat_exists'),
+    func.count().label('total_messages'),
+    # Number of active users (those who wrote messages)
+    func.count(func.distinct(Message.user_id)).label('active_users'),
+    # Media messages
+    func.count().filter(Message.has_media == True).label('media_count'),
+    # Questions (message ends with ?)
+    func.count().filter(Message.is_question == True).label('questions_count')
+).where(Message.chat_id == bindparam('chat_id'))
+# Reactions address the message by (chat_id, message_id); its internal_id is resolved inside the statement
+_REACTION_MESSAGE_CLAUSE = and_(
+    Message.chat_id == bindparam('chat_id', type_=Integer),
+    Message.message_id == bindparam('message_id', type_=Integer),
+)
+_DELETE_REACTIONS_STMT = delete(Reaction).where(
+    Reaction.internal_message_id == select(Message.internal_id).where(_REACTION_MESSAGE_CLAUSE).scalar_subquery(),
+    Reaction.user_id == bindparam('user_id', type_=Integer),
+    Reaction.emoji.in_(bindparam('emojis', expanding=True)),
+)
+# INSERT ... SELECT inserts nothing for an unknown message; Core table so executemany is not an ORM bulk insert
+_INSERT_REACTIONS_STMT = sqlite_insert(Reaction.__table__).from_select(
+    ['internal_message_id', 'user_id', 'emoji'],
+    select(
+        Message.internal_id,
+        bindparam('user_id', type_=Integer),
+        bindparam('emoji', type_=Reaction.emoji.type),
+    ).where(_REACTION_MESSAGE_CLAUSE),
+).on_conflict_do_nothing(index_elements=['internal_message_id', 'user_id', 'emoji'])
+
+class _TTLCache:
+    """Small in-process cache whose entries expire after ttl seconds. Safe to share between run_db worker threads."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                # Drop the oldest entry
+                self._data.pop(next(iter(self._data)), None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+# Chat statistics by chat_id, reset when new messages of the chat are stored
+_chat_stats_cache = _TTLCache(ttl=STATS_CACHE_TTL)
+# Latest summary per chat; replaced by create_summary, dropped by mark_summary_as_published
+_latest_summary_cache = _TTLCache(ttl=STATS_CACHE_TTL)
+
+# Fields compared to decide whether a chat/user payload changed since it was last written
+CHAT_FINGERPRINT_FIELDS = ('title', 'type', 'description', 'member_count')
+USER_FINGERPRINT_FIELDS = ('username', 'first_name', 'last_name', 'is_bot', 'is_premium', 'language_code')
+
+# Fingerprints of recently written chats/users by id; an unchanged payload only bumps the activity timestamp
+_seen_chats = _TTLCache(ttl=ENTITY_CACHE_TTL, maxsize=10_000)
+_seen_users = _TTLCache(ttl=ENTITY_CACHE_TTL, maxsize=10_000)
+
 # --- Functions for working with chats --- 
 
 def get_chat(db: Session, chat_id: int) -> Chat | None:
     """Gets a chat object by its chat_id."""
-    return db.query(Chat).filter(Chat.chat_id == chat_id).first()
+    return db.get(Chat, chat_id) # Primary key lookup, served from identity map when possible
+
+def _chat_values(chat_data: dict) -> dict:
+    """Column values of a chat row built from a Telegram chat dictionary."""
+    return dict(
+        chat_id=chat_data.get('id'),
+        title=chat_data.get('title'),
+        type=chat_data.get('type'),
+        description=chat_data.get('description'),
+        member_count=chat_data.get('member_count'),
+        is_active=True,
+        raw_data=chat_data
+    )
 
-def get_or_create_chat(db: Session, chat_data: dict) -> Chat | None:
-    """Gets an existing chat or creates a new one."""
+def get_or_create_chat(db: Session, chat_data: dict, commit: bool = True) -> Chat | None:
+    """Gets an existing chat or creates a new one. With commit=False changes are left to the caller's transaction."""
     chat_id = chat_data.get('id')
     if not chat_id:
         logger.error("Cannot create/get chat without ID")
         return None
-        
-    chat = get_chat(db, chat_id)
-    now = datetime.now()
-    
-    if chat:
-        # Update existing chat
-        update_stmt = (
+
+    # Same payload written recently: only bump the activity timestamp instead of rewriting the row
+    fingerprint = tuple(chat_data.get(field) for field in CHAT_FINGERPRINT_FIELDS)
+    if _seen_chats.get(chat_id) == fingerprint:
+        touch_stmt = (
             update(Chat)
             .where(Chat.chat_id == chat_id)
-            .values(
-                title=chat_data.get('title', chat.title),
-                type=chat_data.get('type', chat.type),
-                description=chat_data.get('description', chat.description),
-                member_count=chat_data.get('member_count', chat.member_count),
-                last_activity_ts=now,
-                is_active=True, # Consider active if we received data about it
-                raw_data=chat_data
-            )
+            .values(last_activity_ts=datetime.now(), is_active=True)
+            .returning(Chat)
         )
-        db.execute(update_stmt)
-        db.commit()
-        # Return updated object (may require .refresh(chat))
-        return get_chat(db, chat_id) # Re-read to get updated data
-    else:
-        # Create new chat
-        chat = Chat(
-            chat_id=chat_id,
-            title=chat_data.get('title'),
-            type=chat_data.get('type'),
-            description=chat_data.get('description'),
-            member_count=chat_data.get('member_count'),
-            first_seen_ts=now,
-            last_activity_ts=now,
-            is_active=True,
-            raw_data=chat_data
+        chat = db.scalars(touch_stmt, execution_options={'populate_existing': True}).one_or_none()
+        if chat:
+            if commit:
+                db.commit()
+            return chat
+
+    # Single INSERT ... ON CONFLICT DO UPDATE ... RETURNING instead of SELECT + UPDATE/INSERT + re-read.
+    # Fields missing from chat_data keep their stored values
+    upsert_stmt = sqlite_insert(Chat).values(**_chat_values(chat_data))
+    update_values = {
+        field: upsert_stmt.excluded[field]
+        for field in CHAT_FINGERPRINT_FIELDS
+        if field in chat_data
+    }
+    upsert_stmt = upsert_stmt.on_conflict_do_update(
+        index_elements=['chat_id'],
+        set_=dict(
+            update_values,
+            last_activity_ts=datetime.now(),
+            is_active=True, # Consider active if we received data about it
+            raw_data=upsert_stmt.excluded.raw_data
         )
-        db.add(chat)
-        try:
+    ).returning(Chat)
+    try:
+        chat = db.scalars(upsert_stmt, execution_options={'populate_existing': True}).one()
+        if commit:
             db.commit()
-            db.refresh(chat)
-            return chat
-        except IntegrityError as e:
-             logger.error(f"IntegrityError when creating chat {chat_id}: {e}")
-             db.rollback()
-             return get_chat(db, chat_id) # Try to get it in case of race condition
-        except SQLAlchemyError as e:
-            logger.error(f"SQLAlchemy error when creating chat {chat_id}: {e}")
+        _seen_chats.set(chat_id, fingerprint)
+        return chat
+    except SQLAlchemyError as e:
+        logger.error("SQLAlchemy error when saving chat %s: %s", chat_id, e)
+        _seen_chats.invalidate(chat_id)
+        if commit:
             db.rollback()
-            return None
+        return None
 
 def deactivate_chat(db: Session, chat_id: int):
     update_stmt = update(Chat).where(Chat.chat_id == chat_id).values(is_active=False)
     db.execute(update_stmt)
     db.commit()
-    logger.info(f"Chat {chat_id} deactivated")
+    _seen_chats.invalidate(chat_id) # Next payload for the chat has to re-activate it
+    logger.info("Chat %s deactivated", chat_id)
+
+def bulk_upsert_chats(db: Session, chats_data: Iterable[dict]) -> set[int]:
+    """
+    Stores many chats with one executemany upsert; chats unchanged since their last write are only touched.
+    Changes are left to the caller's transaction.
+    
+    Returns:
+        Ids of the stored chats
+    """
+    now = datetime.now()
+    chats_by_id = {chat_data['id']: chat_data for chat_data in chats_data if chat_data.get('id')}
+    fingerprints = {
+        chat_id: tuple(chat_data.get(field) for field in CHAT_FINGERPRINT_FIELDS)
+        for chat_id, chat_data in chats_by_id.items()
+    }
+
+    stored_ids = set()
+    touch_ids = [chat_id for chat_id, fingerprint in fingerprints.items() if _seen_chats.get(chat_id) == fingerprint]
+    if touch_ids:
+        touch_stmt = (
+            update(Chat)
+            .where(Chat.chat_id.in_(touch_ids))
+            .values(last_activity_ts=now, is_active=True)
+            .returning(Chat.chat_id)
+        )
+        stored_ids.update(db.scalars(touch_stmt))
+
+    # New, changed and no longer stored chats are written in full
+    rows = [
+        dict(_chat_values(chat_data), first_seen_ts=now, last_activity_ts=now)
+        for chat_id, chat_data in chats_by_id.items()
+        if chat_id not in stored_ids
+    ]
+    if rows:
+        upsert_stmt = sqlite_insert(Chat)
+        upsert_stmt = upsert_stmt.on_conflict_do_update(
+            index_elements=['chat_id'],
+            set_=dict(
+                # Fields missing from the payload keep their stored values
+                {field: func.coalesce(upsert_stmt.excluded[field], Chat.__table__.c[field]) for field in CHAT_FINGERPRINT_FIELDS},
+                last_activity_ts=upsert_stmt.excluded.last_activity_ts,
+                is_active=True,
+                raw_data=upsert_stmt.excluded.raw_data
+            )
+        )
+        db.execute(upsert_stmt, rows)
+        for row in rows:
+            _seen_chats.set(row['chat_id'], fingerprints[row['chat_id']])
+            stored_ids.add(row['chat_id'])
+    return stored_ids
+
+def get_active_chat_ids(db: Session) -> list[int]:
+    """Gets ids of all chats the bot is still a member of."""
+    return db.scalars(_ACTIVE_CHAT_IDS_STMT).all()
 
 # --- Functions for working with users ---
 
 def get_user(db: Session, user_id: int) -> User | None:
-    return db.query(User).filter(User.user_id == user_id).first()
+    return db.get(User, user_id)
+
+def _user_values(user_data: dict) -> dict:
+    """Column values of a user row built from a Telegram user dictionary."""
+    return dict(
+        user_id=user_data.get('id'),
+        username=user_data.get('username'),
+        first_name=user_data.get('first_name'),
+        last_name=user_data.get('last_name'),
+        is_bot=user_data.get('is_bot', False),
+        is_premium=user_data.get('is_premium'),
+        language_code=user_data.get('language_code'),
+        raw_data=user_data
+    )
 
-def get_or_create_user(db: Session, user_data: dict) -> User | None:
+def get_or_create_user(db: Session, user_data: dict, commit: bool = True) -> User | None:
     user_id = user_data.get('id')
     if not user_id:
         logger.error("Cannot create/get user without ID")
         return None
 
-    user = get_user(db, user_id)
-    now = datetime.now()
-    
-    if user:
-        # Update existing user
-        update_values = {
-            "username": user_data.get('username', user.username),
-            "first_name": user_data.get('first_name', user.first_name),
-            "last_name": user_data.get('last_name', user.last_name),
-            "is_bot": user_data.get('is_bot', user.is_bot),
-            "is_premium": user_data.get('is_premium', user.is_premium),
-            "language_code": user_data.get('language_code', user.language_code),
-            "last_seen_ts": now,
-            "raw_data": user_data
-        }
-        # Remove None values to avoid overwriting existing values with None during update
-        update_values = {k: v for k, v in update_values.items() if v is not None}
-        
-        update_stmt = update(User).where(User.user_id == user_id).values(**update_values)
-        db.execute(update_stmt)
-        db.commit()
-        return get_user(db, user_id)
-    else:
-        # Create new user
-        user = User(
-            user_id=user_id,
-            username=user_data.get('username'),
-            first_name=user_data.get('first_name'),
-            last_name=user_data.get('last_name'),
-            is_bot=user_data.get('is_bot', False),
-            is_premium=user_data.get('is_premium'),
-            language_code=user_data.get('language_code'),
-            first_seen_ts=now,
-            last_seen_ts=now,
-            raw_data=user_data
-        )
-        db.add(user)
-        try:
-            db.commit()
-            db.refresh(user)
+    fingerprint = tuple(user_data.get(field) for field in USER_FINGERPRINT_FIELDS)
+    if _seen_users.get(user_id) == fingerprint:
+        touch_stmt = update(User).where(User.user_id == user_id).values(last_seen_ts=datetime.now()).returning(User)
+        user = db.scalars(touch_stmt, execution_options={'populate_existing': True}).one_or_none()
+        if user:
+            if commit:
+                db.commit()
             return user
-        except IntegrityError as e:
-             logger.error(f"IntegrityError when creating user {user_id}: {e}")
-             db.rollback()
-             return get_user(db, user_id)
-        except SQLAlchemyError as e:
-            logger.error(f"SQLAlchemy error when creating user {user_id}: {e}")
+
+    upsert_stmt = sqlite_insert(User).values(**_user_values(user_data))
+    # Don't overwrite existing values with None during update
+    update_values = {
+        field: upsert_stmt.excluded[field]
+        for field in USER_FINGERPRINT_FIELDS
+        if user_data.get(field) is not None
+    }
+    upsert_stmt = upsert_stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_=dict(update_values, last_seen_ts=datetime.now(), raw_data=upsert_stmt.excluded.raw_data)
+    ).returning(User)
+    try:
+        user = db.scalars(upsert_stmt, execution_options={'populate_existing': True}).one()
+        if commit:
+            db.commit()
+        _seen_users.set(user_id, fingerprint)
+        return user
+    except SQLAlchemyError as e:
+        logger.error("SQLAlchemy error when saving user %s: %s", user_id, e)
+        _seen_users.invalidate(user_id)
+        if commit:
             db.rollback()
-            return None
+        return None
+
+def bulk_upsert_users(db: Session, users_data: Iterable[dict]) -> set[int]:
+    """
+    Stores many users with one executemany upsert; users unchanged since their last write are only touched.
+    Changes are left to the caller's transaction.
+    
+    Returns:
+        Ids of the stored users
+    """
+    now = datetime.now()
+    users_by_id = {user_data['id']: user_data for user_data in users_data if user_data.get('id')}
+    fingerprints = {
+        user_id: tuple(user_data.get(field) for field in USER_FINGERPRINT_FIELDS)
+        for user_id, user_data in users_by_id.items()
+    }
+
+    stored_ids = set()
+    touch_ids = [user_id for user_id, fingerprint in fingerprints.items() if _seen_users.get(user_id) == fingerprint]
+    if touch_ids:
+        touch_stmt = update(User).where(User.user_id.in_(touch_ids)).values(last_seen_ts=now).returning(User.user_id)
+        stored_ids.update(db.scalars(touch_stmt))
+
+    rows = [
+        dict(_user_values(user_data), first_seen_ts=now, last_seen_ts=now)
+        for user_id, user_data in users_by_id.items()
+        if user_id not in stored_ids
+    ]
+    if rows:
+        upsert_stmt = sqlite_insert(User)
+        upsert_stmt = upsert_stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_=dict(
+                # Don't overwrite existing values with None during update
+                {field: func.coalesce(upsert_stmt.excluded[field], User.__table__.c[field]) for field in USER_FINGERPRINT_FIELDS},
+                last_seen_ts=upsert_stmt.excluded.last_seen_ts,
+                raw_data=upsert_stmt.excluded.raw_data
+            )
+        )
+        db.execute(upsert_stmt, rows)
+        for row in rows:
+            _seen_users.set(row['user_id'], fingerprints[row['user_id']])
+            stored_ids.add(row['user_id'])
+    return stored_ids
 
 # --- Functions for working with messages ---
 
+def _message_cache(db: Session) -> dict:
+    """
+    Messages already loaded in this session by (chat_id, message_id).
+    The identity map is keyed by internal_id only, so without it every get_message issues a SELECT.
+    """
+    return db.info.setdefault('message_cache', {})
+
+@event.listens_for(SessionLocal, 'after_soft_rollback')
+def _clear_message_cache(session, previous_transaction):
+    # Rolled back inserts must not be served from the cache
+    session.info.pop('message_cache', None)
+
 def get_message(db: Session, chat_id: int, message_id: int) -> Message | None:
-    return db.query(Message).filter(Message.chat_id == chat_id, Message.message_id == message_id).first()
+    cache = _message_cache(db)
+    message = cache.get((chat_id, message_id))
+    if message is None:
+        message = db.scalars(_GET_MESSAGE_STMT, {'chat_id': chat_id, 'message_id': message_id}).first()
+        if message is not None:
+            cache[(chat_id, message_id)] = message
+    return message
+
+def message_exists(db: Session, chat_id: int, message_id: int) -> bool:
+    """Checks whether a message is stored without loading it."""
+    if (chat_id, message_id) in _message_cache(db):
+        return True
+    return db.scalar(_MESSAGE_EXISTS_STMT, {'chat_id': chat_id, 'message_id': message_id})
 
 def get_message_by_internal_id(db: Session, internal_id: int) -> Message | None:
-    return db.query(Message).filter(Message.internal_id == internal_id).first()
+    return db.get(Message, internal_id)
+
+def get_messages_bulk(db: Session, chat_id: int, message_ids: Iterable[int]) -> dict[int, Message]:
+    """Gets messages of a chat by their Telegram message_ids with one query, keyed by message_id."""
+    cache = _message_cache(db)
+    found = {}
+    missing_ids = []
+    for message_id in message_ids:
+        message = cache.get((chat_id, message_id))
+        if message is None:
+            missing_ids.append(message_id)
+        else:
+            found[message_id] = message
+    if missing_ids:
+        for message in db.scalars(_MESSAGES_BULK_STMT, {'chat_id': chat_id, 'message_ids': missing_ids}):
+            cache[(chat_id, message.message_id)] = message
+            found[message.message_id] = message
+    return found
 
 def create_or_update_topic_message(db: Session, chat_id: int, thread_id: int, topic_data: dict, user_data: dict, 
-                                   date_ts: datetime, raw_data: dict = None) -> Message | None:
+                                   date_ts: datetime, raw_data: dict = None, commit: bool = True) -> Message | None:
     """
     Creates or updates a topic message.
     
@@ -159,186 +446,246 @@ def create_or_update_topic_message(db: Session, chat_id: int, thread_id: int, to
         user_data: Data about the user who created the topic
         date_ts: Topic creation date
         raw_data: Raw message data if available
+        commit: Commit right away; with False changes are left to the caller's transaction
     
     Returns:
         Message: Created or updated topic message
     """
-    # Check if topic message exists
-    topic_message = get_message(db, chat_id, thread_id)
-    
     # Get topic name
     topic_name = topic_data.get('name', 'Unknown topic')
     icon_color = topic_data.get('icon_color')
     topic_text = f"[Created topic: {topic_name}]"
     
-    # If message exists, just update topic information
-    if topic_message:
-        # Update only if this message does not have text or has topic message format
-        if not topic_message.text or topic_message.text.startswith('[Created topic:'):
-            update_stmt = (
-                update(Message)
-                .where(Message.internal_id == topic_message.internal_id)
-                .values(
-                    text=topic_text,
-                    message_thread_id=thread_id
-                )
+    # Topics are mostly restored for messages that are not stored yet, so creating the "virtual" message
+    # comes first: one INSERT ... ON CONFLICT DO NOTHING RETURNING, which leaves an existing message alone
+    user_id = user_data.get('id')
+    user = get_or_create_user(db, user_data, commit=False)
+    if user:
+        insert_stmt = (
+            sqlite_insert(Message)
+            .values(
+                message_id=thread_id,
+                chat_id=chat_id,
+                user_id=user_id,
+                date_ts=date_ts,
+                text=topic_text,
+                message_thread_id=thread_id,  # Topic refers to itself
+                has_media=False,
+                raw_data=raw_data
             )
-            if raw_data and not topic_message.raw_data:
-                update_stmt = update_stmt.values(raw_data=raw_data)
-            
-            db.execute(update_stmt)
-            try:
+            .on_conflict_do_nothing(index_elements=['chat_id', 'message_id'])
+            .returning(Message)
+        )
+        try:
+            new_topic_message = db.scalars(insert_stmt).one_or_none()
+            if commit:
                 db.commit()
-                logger.info(f"Updated topic information for '{topic_name}' (ID: {thread_id}) in chat {chat_id}")
-                return get_message_by_internal_id(db, topic_message.internal_id)
-            except SQLAlchemyError as e:
-                logger.error(f"SQLAlchemy error when updating topic {thread_id} in chat {chat_id}: {e}")
+        except SQLAlchemyError as e:
+            logger.error("SQLAlchemy error when creating topic %s in chat %s: %s", thread_id, chat_id, e)
+            if commit:
                 db.rollback()
-                return topic_message
-        return topic_message
+            return None
+        if new_topic_message:
+            _message_cache(db)[(chat_id, thread_id)] = new_topic_message
+            logger.info("Created virtual record for topic '%s' (ID: %s) in chat %s", topic_name, thread_id, chat_id)
+            return new_topic_message
     
-    # If message does not exist, create "virtual" message
-    # First, ensure user exists
-    user_id = user_data.get('id')
-    user = get_or_create_user(db, user_data)
-    if not user:
-        logger.error(f"Failed to get/create user ({user_id}) for topic {thread_id}")
+    # Message already exists (or its author could not be stored): just update topic information
+    topic_message = get_message(db, chat_id, thread_id)
+    if not topic_message:
+        logger.error("Failed to get/create user (%s) for topic %s", user_id, thread_id)
         return None
     
-    # Create topic message
-    new_topic_message = Message(
-        message_id=thread_id,
-        chat_id=chat_id,
-        user_id=user_id,
-        date_ts=date_ts,
-        text=topic_text,
-        message_thread_id=thread_id,  # Topic refers to itself
-        has_media=False,
-        raw_data=raw_data
-    )
-    
-    db.add(new_topic_message)
-    try:
-        db.commit()
-        db.refresh(new_topic_message)
-        logger.info(f"Created virtual record for topic '{topic_name}' (ID: {thread_id}) in chat {chat_id}")
-        return new_topic_message
-    except IntegrityError as e:
-        logger.warning(f"Topic {thread_id} in chat {chat_id}, probably already exists: {e}")
-        db.rollback()
-        return get_message(db, chat_id, thread_id)
-    except SQLAlchemyError as e:
-        logger.error(f"SQLAlchemy error when creating topic {thread_id} in chat {chat_id}: {e}")
-        db.rollback()
-        return None
+    # Update only if this message does not have text or has topic message format
+    if not topic_message.text or topic_message.text.startswith('[Created topic:'):
+        update_stmt = (
+            update(Message)
+            .where(Message.internal_id == topic_message.internal_id)
+            .values(
+                text=topic_text,
+                message_thread_id=thread_id
+            )
+        )
+        if raw_data:
+            # Keep stored raw_data if any; checked in SQL so the deferred column is not loaded
+            update_stmt = update_stmt.values(
+                raw_data=func.coalesce(Message.raw_data, bindparam('raw_data', raw_data, type_=Message.raw_data.type))
+            )
+        # Updated row comes back from the UPDATE itself; wrapped in a select so populate_existing
+        # also refreshes the computed is_question of an already loaded message
+        update_stmt = select(Message).from_statement(update_stmt.returning(Message))
+        
+        try:
+            updated_message = db.scalars(update_stmt, execution_options={'populate_existing': True}).one()
+            if commit:
+                db.commit()
+            logger.info("Updated topic information for '%s' (ID: %s) in chat %s", topic_name, thread_id, chat_id)
+            return updated_message
+        except SQLAlchemyError as e:
+            logger.error("SQLAlchemy error when updating topic %s in chat %s: %s", thread_id, chat_id, e)
+            if commit:
+                db.rollback()
+    return topic_message
 
-def create_message(db: Session, message_data: dict) -> Message | None:
-    chat_data = message_data.get('chat')
-    user_data = message_data.get('from')
-    message_id = message_data.get('message_id')
+def _prepare_message_values(db: Session, message_data: dict, batch_keys: set | None = None,
+                            known_messages: dict | None = None, known_chat_ids: set | None = None,
+                            known_user_ids: set | None = None) -> tuple[dict, int | None] | None:
+    """
+    Resolves related entities (chat, user, reply, topic, forward) and builds column values for a message.
+    
+    Args:
+        db: Database session
+        message_data: Telegram message as a dictionary
+        batch_keys: (chat_id, message_id) pairs inserted in the same batch, used to defer replies
+                    to messages that are not stored yet
+        known_messages: Prefetched reply/topic messages by (chat_id, message_id), None for missing ones;
+                        keys not present are looked up one by one
+        known_chat_ids: Chats already stored in this transaction, not upserted again
+        known_user_ids: Users already stored in this transaction, not upserted again
+    
+    Returns:
+        Tuple of column values and message_id of a deferred reply target, or None if data is insufficient
+    """
+    # Read every field once; this runs for each incoming message
+    get = message_data.get
+    chat_data = get('chat')
+    user_data = get('from')
+    message_id = get('message_id')
     
     if not chat_data or not user_data or not message_id:
-        logger.error(f"Not enough data to create message: {message_data.get('update_id')}")
+        logger.error("Not enough data to create message: %s", get('update_id'))
         return None
         
     chat_id = chat_data.get('id')
     user_id = user_data.get('id')
+    message_date = get('date')
+    edit_date = get('edit_date')
+    thread_id = get('message_thread_id')
+    is_topic_message = get('is_topic_message')
+    reply_data = get('reply_to_message')
+    topic_created_data = reply_data.get('forum_topic_created') if reply_data else None
+    if known_messages is None:
+        known_messages = {}
+    if known_chat_ids is None:
+        known_chat_ids = set()
+    if known_user_ids is None:
+        known_user_ids = set()
+
+    def find_message(msg_id: int) -> Message | None:
+        if (chat_id, msg_id) in known_messages:
+            return known_messages[(chat_id, msg_id)]
+        return get_message(db, chat_id, msg_id)
+
+    def message_is_stored(msg_id: int) -> bool:
+        if (chat_id, msg_id) in known_messages:
+            return known_messages[(chat_id, msg_id)] is not None
+        return message_exists(db, chat_id, msg_id)
+
+    def ensure_chat(data: dict) -> int | None:
+        if data.get('id') in known_chat_ids:
+            return data['id']
+        chat = get_or_create_chat(db, data, commit=False)
+        return chat.chat_id if chat else None
+
+    def ensure_user(data: dict) -> int | None:
+        if data.get('id') in known_user_ids:
+            return data['id']
+        user = get_or_create_user(db, data, commit=False)
+        return user.user_id if user else None
     
-    # Ensure chat and user exist
-    chat = get_or_create_chat(db, chat_data)
-    user = get_or_create_user(db, user_data)
-    if not chat or not user:
-        logger.error(f"Failed to get/create chat ({chat_id}) or user ({user_id}) for message {message_id}")
+    # Ensure chat and user exist; everything below is committed together with the message
+    if not ensure_chat(chat_data) or not ensure_user(user_data):
+        logger.error("Failed to get/create chat (%s) or user (%s) for message %s", chat_id, user_id, message_id)
         return None
 
     # Handle reply
     reply_to_internal_id = None
-    reply_data = message_data.get('reply_to_message')
+    deferred_reply_id = None
     if reply_data:
         reply_msg_id = reply_data.get('message_id')
         reply_chat_id = reply_data.get('chat', {}).get('id')
         if reply_msg_id and reply_chat_id == chat_id: # Ensure reply is in the same chat
-            original_msg = get_message(db, chat_id, reply_msg_id)
+            original_msg = find_message(reply_msg_id)
             
             # If this is a reply to a topic message and it doesn't exist in the database, create virtual record
-            if not original_msg and reply_data.get('forum_topic_created') and message_data.get('is_topic_message'):
-                topic_data = reply_data.get('forum_topic_created')
+            if not original_msg and topic_created_data and is_topic_message:
                 reply_user_data = reply_data.get('from')
-                reply_date_ts = datetime.fromtimestamp(reply_data.get('date'))
+                reply_date_ts = _from_timestamp(reply_data.get('date'))
                 
                 # Create virtual message for topic
                 original_msg = create_or_update_topic_message(
                     db=db, 
                     chat_id=chat_id, 
                     thread_id=reply_msg_id, 
-                    topic_data=topic_data, 
+                    topic_data=topic_created_data, 
                     user_data=reply_user_data, 
                     date_ts=reply_date_ts, 
-                    raw_data=reply_data
+                    raw_data=reply_data,
+                    commit=False
                 )
+                known_messages[(chat_id, reply_msg_id)] = original_msg
             
             if original_msg:
                 reply_to_internal_id = original_msg.internal_id
+            elif batch_keys and (chat_id, reply_msg_id) in batch_keys:
+                # Original message is part of the same batch, link it after insert
+                deferred_reply_id = reply_msg_id
             else:
-                logger.warning(f"Original message ({reply_msg_id}) not found for reply in message {message_id} chat {chat_id}")
+                logger.warning("Original message (%s) not found for reply in message %s chat %s", reply_msg_id, message_id, chat_id)
     
     # Check if message is part of topic but not first message in topic
     # If yes and topic message is missing, try to restore it
-    if message_data.get('is_topic_message') and message_data.get('message_thread_id'):
-        thread_id = message_data.get('message_thread_id')
-        
+    if is_topic_message and thread_id:
         # If message is not topic creator
         if message_id != thread_id:
-            topic_message = get_message(db, chat_id, thread_id)
+            # Only existence matters here; the topic message itself is not used
+            topic_stored = message_is_stored(thread_id)
             
             # If topic information is missing and there's reply_to_message with forum_topic_created
-            if not topic_message and reply_data and reply_data.get('forum_topic_created'):
+            if not topic_stored and topic_created_data:
                 # This case should be handled above when processing reply
                 pass
             # If we don't have created information but there's thread_id, create basic record
-            elif not topic_message:
+            elif not topic_stored:
                 # Create minimal record for topic
                 default_topic_data = {'name': f'Topic #{thread_id}'}
-                default_date_ts = datetime.fromtimestamp(message_data.get('date', int(datetime.now().timestamp())))
+                default_date_ts = _from_timestamp(message_date) if message_date else datetime.now()
                 
-                create_or_update_topic_message(
+                known_messages[(chat_id, thread_id)] = create_or_update_topic_message(
                     db=db,
                     chat_id=chat_id,
                     thread_id=thread_id,
                     topic_data=default_topic_data,
                     user_data=user_data,  # Use current user as creator (though it may not be him)
                     date_ts=default_date_ts,
-                    raw_data=None
+                    raw_data=None,
+                    commit=False
                 )
     
     # Handle forwarding
     forward_from_user_id = None
     forward_from_chat_id = None
     forward_date_ts = None
-    forward_user_data = message_data.get('forward_from')
-    forward_chat_data = message_data.get('forward_from_chat')
-    forward_date_raw = message_data.get('forward_date')
+    forward_user_data = get('forward_from')
+    forward_chat_data = get('forward_from_chat')
+    forward_date_raw = get('forward_date')
     if forward_user_data:
-        fw_user = get_or_create_user(db, forward_user_data)
-        if fw_user:
-            forward_from_user_id = fw_user.user_id
+        forward_from_user_id = ensure_user(forward_user_data)
     if forward_chat_data:
-        fw_chat = get_or_create_chat(db, forward_chat_data)
-        if fw_chat:
-            forward_from_chat_id = fw_chat.chat_id
+        forward_from_chat_id = ensure_chat(forward_chat_data)
     if forward_date_raw:
         try:
-            forward_date_ts = datetime.fromtimestamp(forward_date_raw)
+            forward_date_ts = _from_timestamp(forward_date_raw)
         except Exception as e:
-             logger.error(f"Error converting forward_date {forward_date_raw}: {e}")
+             logger.error("Error converting forward_date %s: %s", forward_date_raw, e)
     
     # Handle media
     has_media = False
     media_type = None
     media_file_id = None
     media_file_unique_id = None
-    photo = message_data.get('photo')
-    video = message_data.get('video')
+    photo = get('photo')
+    video = get('video')
     # ... add other media types ...
     if photo:
         has_media = True
@@ -353,107 +700,291 @@ def create_message(db: Session, message_data: dict) -> Message | None:
         media_file_unique_id = video.get('file_unique_id')
         # file_name = video.get('file_name') # Can add field to model
 
-    # Create message object
-    new_message = Message(
+    values = dict(
         message_id=message_id,
         chat_id=chat_id,
         user_id=user_id,
-        date_ts=datetime.fromtimestamp(message_data.get('date')),
-        edit_date_ts=datetime.fromtimestamp(message_data.get('edit_date')) if message_data.get('edit_date') else None,
-        text=message_data.get('text'),
-        caption=message_data.get('caption'),
-        entities=message_data.get('entities'),
+        date_ts=_from_timestamp(message_date),
+        edit_date_ts=_from_timestamp(edit_date) if edit_date else None,
+        text=get('text'),
+        caption=get('caption'),
+        entities=get('entities'),
         reply_to_internal_id=reply_to_internal_id,
         forward_from_user_id=forward_from_user_id,
         forward_from_chat_id=forward_from_chat_id,
         forward_date_ts=forward_date_ts,
-        message_thread_id=message_data.get('message_thread_id'),
+        message_thread_id=thread_id,
         has_media=has_media,
         media_type=media_type,
         media_file_id=media_file_id,
         media_file_unique_id=media_file_unique_id,
         raw_data=message_data
     )
-    
-    db.add(new_message)
+    return values, deferred_reply_id
+
+def create_message(db: Session, message_data: dict) -> Message | None:
+    prepared = _prepare_message_values(db, message_data)
+    if not prepared:
+        return None
+    values, _ = prepared
+    chat_id = values['chat_id']
+    message_id = values['message_id']
+
+    # INSERT ... RETURNING gives back the row with internal_id and computed columns in one round trip
+    insert_stmt = sqlite_insert(Message).values(**values).returning(Message)
     try:
+        new_message = db.scalars(insert_stmt).one()
         db.commit()
-        db.refresh(new_message)
+        _chat_stats_cache.invalidate(chat_id)
+        _message_cache(db)[(chat_id, message_id)] = new_message
         return new_message
     except IntegrityError as e:
-        logger.warning(f"Message {message_id} in chat {chat_id}, probably already exists: {e}")
+        logger.warning("Message %s in chat %s, probably already exists: %s", message_id, chat_id, e)
         db.rollback()
         return get_message(db, chat_id, message_id) # Return existing
     except SQLAlchemyError as e:
-        logger.error(f"SQLAlchemy error when creating message {message_id} in chat {chat_id}: {e}")
+        logger.error("SQLAlchemy error when creating message %s in chat %s: %s", message_id, chat_id, e)
         db.rollback()
         return None
 
+def create_messages(db: Session, messages_data: list[dict]) -> dict[tuple[int, int], int]:
+    """
+    Stores a batch of messages with one executemany INSERT instead of a commit per message.
+    
+    Already stored messages are skipped; messages carrying edit_date update the stored copy
+    if the edit is newer. Replies to messages from the same batch are linked after insert.
+    
+    Args:
+        db: Database session
+        messages_data: List of Telegram messages as dictionaries
+    
+    Returns:
+        Mapping of (chat_id, message_id) to internal_id for inserted or updated messages
+    """
+    if not messages_data:
+        return {}
+
+    batch_keys = {(m.get('chat', {}).get('id'), m.get('message_id')) for m in messages_data}
+
+    # Reply targets and topic messages of the whole batch are fetched with one query per chat
+    wanted_ids = defaultdict(set)
+    for message_data in messages_data:
+        chat_id = message_data.get('chat', {}).get('id')
+        reply_msg_id = (message_data.get('reply_to_message') or {}).get('message_id')
+        if reply_msg_id:
+            wanted_ids[chat_id].add(reply_msg_id)
+        if message_data.get('is_topic_message') and message_data.get('message_thread_id'):
+            wanted_ids[chat_id].add(message_data.get('message_thread_id'))
+    known_messages = {}
+    for chat_id, message_ids in wanted_ids.items():
+        found = get_messages_bulk(db, chat_id, message_ids)
+        for message_id in message_ids:
+            known_messages[(chat_id, message_id)] = found.get(message_id)
+
+    # Chats and users of the whole batch are written with one upsert per table; the latest payload wins
+    chats_data = {}
+    users_data = {}
+    for message_data in messages_data:
+        for chat_data in (message_data.get('chat'), message_data.get('forward_from_chat')):
+            if chat_data and chat_data.get('id'):
+                chats_data[chat_data['id']] = chat_data
+        for user_data in (message_data.get('from'), message_data.get('forward_from')):
+            if user_data and user_data.get('id'):
+                users_data[user_data['id']] = user_data
+    try:
+        known_chat_ids = bulk_upsert_chats(db, chats_data.values())
+        known_user_ids = bulk_upsert_users(db, users_data.values())
+    except SQLAlchemyError as e:
+        logger.warning("SQLAlchemy error when storing chats and users of a batch, storing them per message: %s", e)
+        db.rollback()
+        known_chat_ids, known_user_ids = set(), set()
+
+    new_rows = []
+    edited_rows = []
+    deferred_replies = []
+    for message_data in messages_data:
+        prepared = _prepare_message_values(db, message_data, batch_keys, known_messages,
+                                           known_chat_ids, known_user_ids)
+        if not prepared:
+            continue
+        values, deferred_reply_id = prepared
+        if values['edit_date_ts']:
+            edited_rows.append(values)
+        else:
+            new_rows.append(values)
+        if deferred_reply_id:
+            deferred_replies.append((values['chat_id'], values['message_id'], deferred_reply_id))
+
+    # Ids come back from the INSERT itself via RETURNING
+    returned_columns = (Message.internal_id, Message.chat_id, Message.message_id)
+    stored_ids = {}
+    try:
+        if new_rows:
+            insert_stmt = (
+                sqlite_insert(Message)
+                .on_conflict_do_nothing(index_elements=['chat_id', 'message_id'])
+                .returning(*returned_columns)
+            )
+            for internal_id, chat_id, message_id in db.execute(insert_stmt, new_rows):
+                stored_ids[(chat_id, message_id)] = internal_id
+        if edited_rows:
+            upsert_stmt = sqlite_insert(Message)
+            upsert_stmt = upsert_stmt.on_conflict_do_update(
+                index_elements=['chat_id', 'message_id'],
+                set_={
+                    'text': upsert_stmt.excluded.text,
+                    'caption': upsert_stmt.excluded.caption,
+                    'entities': upsert_stmt.excluded.entities,
+                    'edit_date_ts': upsert_stmt.excluded.edit_date_ts,
+                    'raw_data': upsert_stmt.excluded.raw_data
+                },
+                where=or_(Message.edit_date_ts.is_(None), Message.edit_date_ts < upsert_stmt.excluded.edit_date_ts)
+            ).returning(*returned_columns)
+            for internal_id, chat_id, message_id in db.execute(upsert_stmt, edited_rows):
+                stored_ids[(chat_id, message_id)] = internal_id
+
+        # Link replies to messages from the same batch using the returned ids
+        reply_links = [
+            {'b_internal_id': stored_ids[(chat_id, message_id)], 'b_reply_internal_id': stored_ids[(chat_id, reply_id)]}
+            for chat_id, message_id, reply_id in deferred_replies
+            if (chat_id, message_id) in stored_ids and (chat_id, reply_id) in stored_ids
+        ]
+        if reply_links:
+            messages_table = Message.__table__
+            reply_stmt = (
+                update(messages_table)
+                .where(messages_table.c.internal_id == bindparam('b_internal_id'))
+                .values(reply_to_internal_id=bindparam('b_reply_internal_id'))
+            )
+            db.execute(reply_stmt, reply_links)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        if len(messages_data) == 1:
+            logger.error("SQLAlchemy error when storing message %s: %s", messages_data[0].get('message_id'), e)
+            return {}
+        # Don't lose the whole batch because of one bad message: store them one by one
+        logger.warning("SQLAlchemy error when storing batch of %s messages, retrying one by one: %s", len(messages_data), e)
+        stored_ids = {}
+        for message_data in messages_data:
+            stored_ids.update(create_messages(db, [message_data]))
+        return stored_ids
+
+    for chat_id in {chat_id for chat_id, _ in stored_ids}:
+        _chat_stats_cache.invalidate(chat_id)
+
+    return stored_ids
+
 def update_message(db: Session, message_data: dict) -> Message | None:
     chat_data = message_data.get('chat')
     message_id = message_data.get('message_id')
     edit_date_raw = message_data.get('edit_date')
 
     if not chat_data or not message_id or not edit_date_raw:
-        logger.error(f"Not enough data to update message: {message_data.get('update_id')}")
+        logger.error("Not enough data to update message: %s", message_data.get('update_id'))
         return None
 
     chat_id = chat_data.get('id')
-    existing_message = get_message(db, chat_id, message_id)
+    edit_date_ts = _from_timestamp(edit_date_raw)
 
-    if not existing_message:
-        logger.warning(f"Attempting to update non-existing message: chat={chat_id}, msg={message_id}")
-        # Can try to create it if this is edited_message
-        if message_data.get('message'): # If this is full message from edited_message
-             return create_message(db, message_data.get('message'))
-        return None
+    # Fields missing in the update keep their stored values
+    update_values = {
+        field: message_data[field]
+        for field in ('text', 'caption', 'entities')
+        if field in message_data
+    }
+    update_values['edit_date_ts'] = edit_date_ts
+    update_values['raw_data'] = message_data # Update raw_data
 
-    # Update only if edit_date is newer
-    edit_date_ts = datetime.fromtimestamp(edit_date_raw)
-    if not existing_message.edit_date_ts or edit_date_ts > existing_message.edit_date_ts:
-        update_stmt = (
-            update(Message)
-            .where(Message.internal_id == existing_message.internal_id)
-            .values(
-                text=message_data.get('text', existing_message.text),
-                caption=message_data.get('caption', existing_message.caption),
-                entities=message_data.get('entities', existing_message.entities),
-                edit_date_ts=edit_date_ts,
-                raw_data=message_data # Update raw_data
-            )
+    # Single UPDATE guarded by edit_date instead of SELECT-then-UPDATE
+    update_stmt = (
+        update(Message)
+        .where(
+            Message.chat_id == chat_id,
+            Message.message_id == message_id,
+            or_(Message.edit_date_ts.is_(None), Message.edit_date_ts < edit_date_ts) # Update only if edit_date is newer
         )
-        db.execute(update_stmt)
-        try:
-            db.commit()
-            return get_message_by_internal_id(db, existing_message.internal_id)
-        except SQLAlchemyError as e:
-            logger.error(f"SQLAlchemy error when updating message {message_id} in chat {chat_id}: {e}")
-            db.rollback()
-            return None
-    else:
-        # logger.debug(f"Skipping message update {message_id} in chat {chat_id}: edit_date not newer.")
-        return existing_message
-
-def get_unsummarized_messages(db: Session, chat_id: int, limit: int = 1000) -> list[Message]:
-    """Gets last N unprocessed messages from chat."""
-    return (
-        db.query(Message)
-        .filter(Message.chat_id == chat_id, Message.summarized == False)
-        .order_by(Message.date_ts.asc()) # From old to new for summarization
-        .limit(limit)
-        .all()
+        .values(**update_values)
+        .returning(Message)
     )
+    # ORM UPDATE ... RETURNING does not overwrite attributes of a message already in the session,
+    # selecting from the statement does, including the computed is_question
+    update_stmt = select(Message).from_statement(update_stmt)
+    try:
+        updated_message = db.scalars(update_stmt, execution_options={'populate_existing': True}).one_or_none()
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error("SQLAlchemy error when updating message %s in chat %s: %s", message_id, chat_id, e)
+        db.rollback()
+        return None
+
+    if updated_message:
+        if 'text' in update_values or 'caption' in update_values:
+            _chat_stats_cache.invalidate(chat_id) # Edited text may change the question count
+        return updated_message
+
+    # Nothing updated: the message is unknown or edit_date is not newer
+    existing_message = get_message(db, chat_id, message_id)
+    if not existing_message:
+        # The edited message is a complete message: store it as is if the original was never seen
+        logger.info("Storing edited message that was not stored before: chat=%s, msg=%s", chat_id, message_id)
+        return create_message(db, message_data)
+
+    # logger.debug("Skipping message update %s in chat %s: edit_date not newer.", message_id, chat_id)
+    return existing_message
+
+def get_unsummarized_messages(db: Session, chat_id: int, limit: int = 1000, since: datetime | None = None,
+                              after: Message | None = None) -> list[Message]:
+    """
+    Gets N oldest unprocessed messages from chat.
+    
+    Args:
+        db: Database session
+        chat_id: Chat ID
+        limit: Maximum number of messages to return
+        since: Only messages sent at or after this date
+        after: Last message of the previous page; the page continues right after it (keyset pagination)
+    
+    Returns:
+        List of messages ordered by date
+    """
+    params = {'chat_id': chat_id, 'limit': limit}
+    if since is not None:
+        params['since'] = since
+    if after is not None:
+        params['after_date_ts'] = after.date_ts
+        params['after_id'] = after.internal_id
+
+    if since is None and after is None:
+        stmt = _UNSUMMARIZED_MESSAGES_STMT
+    elif after is None:
+        stmt = _UNSUMMARIZED_MESSAGES_SINCE_STMT
+    elif since is None:
+        stmt = _UNSUMMARIZED_MESSAGES_AFTER_STMT
+    else:
+        stmt = _UNSUMMARIZED_MESSAGES_SINCE_AFTER_STMT
+    return db.scalars(stmt, params).all()
 
 def mark_messages_as_summarized(db: Session, internal_ids: list[int]):
     """Marks messages as processed by their internal_id."""
     if not internal_ids:
         return
+    if len(internal_ids) <= MARK_SUMMARIZED_TEMP_TABLE_THRESHOLD:
+        ids_clause = Message.internal_id.in_(internal_ids)
+    else:
+        # Long IN lists hit the bound parameter limit and are costly to plan; join against a temp table instead
+        _summarized_ids.create(db.connection(), checkfirst=True)
+        db.execute(insert(_summarized_ids), [{'id': internal_id} for internal_id in set(internal_ids)])
+        ids_clause = Message.internal_id.in_(select(_summarized_ids.c.id))
     update_stmt = (
         update(Message)
-        .where(Message.internal_id.in_(internal_ids))
+        .where(ids_clause)
         .values(summarized=True)
+        .execution_options(synchronize_session=False) # Skip matching objects in session
     )
     db.execute(update_stmt)
+    if len(internal_ids) > MARK_SUMMARIZED_TEMP_TABLE_THRESHOLD:
+        db.execute(delete(_summarized_ids))
     db.commit()
 
 # --- Functions for working with reactions ---
@@ -466,62 +997,40 @@ def update_reactions(db: Session, reaction_data: dict):
     new_reactions_raw = reaction_data.get('new_reaction', [])
     
     if not chat_data or not user_data or not message_id:
-        logger.error(f"Not enough data to update reactions: {reaction_data}")
+        logger.error("Not enough data to update reactions: %s", reaction_data)
         return
 
     chat_id = chat_data.get('id')
     user_id = user_data.get('id')
 
-    # Get internal ID of message
-    message = get_message(db, chat_id, message_id)
-    if not message:
-        logger.warning(f"Message {message_id} in chat {chat_id} not found for updating reactions.")
-        return
-    internal_message_id = message.internal_id
-
-    # Ensure user exists
-    user = get_or_create_user(db, user_data)
+    # Ensure user exists; committed together with the reactions
+    user = get_or_create_user(db, user_data, commit=False)
     if not user:
-        logger.error(f"Failed to get/create user ({user_id}) for updating reactions")
+        logger.error("Failed to get/create user (%s) for updating reactions", user_id)
         return
 
     # Get old and new emojis
-    old_emojis = set(r.get('emoji') for r in old_reactions_raw if r.get('type') == 'emoji')
-    new_emojis = set(r.get('emoji') for r in new_reactions_raw if r.get('type') == 'emoji')
+    old_emojis = {r['emoji'] for r in old_reactions_raw if r.get('type') == 'emoji'}
+    new_emojis = {r['emoji'] for r in new_reactions_raw if r.get('type') == 'emoji'}
     
     emojis_to_remove = old_emojis - new_emojis
     emojis_to_add = new_emojis - old_emojis
     
-    now = datetime.now()
-    
+    # Reactions to messages that are not stored (e.g. sent before the bot joined) match no row
+    message_key = {'chat_id': chat_id, 'message_id': message_id, 'user_id': user_id}
     try:
         # Remove old reactions
         if emojis_to_remove:
-            delete_stmt = (
-                delete(Reaction)
-                .where(
-                    Reaction.internal_message_id == internal_message_id,
-                    Reaction.user_id == user_id,
-                    Reaction.emoji.in_(emojis_to_remove)
-                )
-            )
-            db.execute(delete_stmt)
+            db.execute(_DELETE_REACTIONS_STMT, dict(message_key, emojis=list(emojis_to_remove)))
             
-        # Add new reactions
+        # Add new reactions; ones already stored are skipped by the primary key
         if emojis_to_add:
-            new_reaction_objects = [
-                Reaction(
-                    internal_message_id=internal_message_id,
-                    user_id=user_id,
-                    emoji=emoji,
-                    added_ts=now
-                ) for emoji in emojis_to_add
-            ]
-            db.add_all(new_reaction_objects)
+            db.execute(_INSERT_REACTIONS_STMT, [dict(message_key, emoji=emoji) for emoji in emojis_to_add])
             
         db.commit()
     except SQLAlchemyError as e:
-        logger.error(f"SQLAlchemy error when updating reactions for message {internal_message_id}, user {user_id}: {e}")
+        logger.error("SQLAlchemy error when updating reactions for message %s in chat %s, user %s: %s",
+                     message_id, chat_id, user_id, e)
         db.rollback()
 
 # --- Functions for working with summaries ---
@@ -539,16 +1048,15 @@ def create_summary(
         text=text,
         message_count=message_count,
         first_message_internal_id=first_message_internal_id,
-        last_message_internal_id=last_message_internal_id,
-        created_ts=datetime.now()
+        last_message_internal_id=last_message_internal_id
     )
     db.add(summary)
     try:
         db.commit()
-        db.refresh(summary)
+        _latest_summary_cache.set(chat_id, summary)
         return summary
     except SQLAlchemyError as e:
-        logger.error(f"SQLAlchemy error when creating summary for chat {chat_id}: {e}")
+        logger.error("SQLAlchemy error when creating summary for chat %s: %s", chat_id, e)
         db.rollback()
         return None
 
@@ -557,24 +1065,32 @@ def mark_summary_as_published(db: Session, summary_id: int):
         update(Summary)
         .where(Summary.id == summary_id)
         .values(published=True, published_ts=datetime.now())
+        .returning(Summary.chat_id)
     )
-    db.execute(update_stmt)
+    chat_id = db.scalars(update_stmt).first()
     db.commit()
+    if chat_id is not None:
+        _latest_summary_cache.invalidate(chat_id)
 
 def get_latest_summary(db: Session, chat_id: int) -> Summary | None:
-    """Gets the latest summary for a chat."""
-    return (
-        db.query(Summary)
-        .filter(Summary.chat_id == chat_id)
-        .order_by(Summary.created_ts.desc())
-        .first()
-    )
+    """Gets the latest summary for a chat. Results are cached until the next summary of the chat is created or published."""
+    summary = _latest_summary_cache.get(chat_id)
+    if summary is None:
+        summary = db.scalars(_LATEST_SUMMARY_STMT, {'chat_id': chat_id}).first()
+        if summary is not None:
+            _latest_summary_cache.set(chat_id, summary)
+    return summary
 
 def get_chat_stats(db: Session, chat_id: int) -> dict:
-    """Gets statistics for a chat."""
-    # Check if chat exists
-    chat = get_chat(db, chat_id)
-    if not chat:
+    """Gets statistics for a chat. Results are cached for STATS_CACHE_TTL seconds."""
+    cached_stats = _chat_stats_cache.get(chat_id)
+    if cached_stats is not None:
+        return cached_stats
+
+    chat_exists, total_messages, active_users, media_count, questions_count = db.execute(
+        _CHAT_STATS_STMT, {'chat_id': chat_id}
+    ).one()
+    if not chat_exists:
         return {
             "exists": False,
             "total_messages": 0,
@@ -583,31 +1099,15 @@ def get_chat_stats(db: Session, chat_id: int) -> dict:
             "questions_count": 0
         }
     
-    # Get total messages
-    total_messages = db.query(Message).filter(Message.chat_id == chat_id).count()
-    
-    # Get number of active users (those who wrote messages)
-    active_users = db.query(Message.user_id).filter(Message.chat_id == chat_id).distinct().count()
-    
-    # Count media messages
-    media_count = db.query(Message).filter(
-        Message.chat_id == chat_id,
-        Message.has_media == True
-    ).count()
-    
-    # Count questions (message ends with ?)
-    questions_count = db.query(Message).filter(
-        Message.chat_id == chat_id,
-        Message.text.like('%?')
-    ).count()
-    
-    return {
+    stats = {
         "exists": True,
         "total_messages": total_messages,
         "active_users": active_users,
         "media_count": media_count,
         "questions_count": questions_count
     }
+    _chat_stats_cache.set(chat_id, stats)
+    return stats
 
 def get_messages_by_date_range(db: Session, chat_id: int, 
                               start_date: datetime = None, 
@@ -628,26 +1128,26 @@ def get_messages_by_date_range(db: Session, chat_id: int,
     Returns:
         List of messages
     """
-    query = db.query(Message).filter(Message.chat_id == chat_id)
+    stmt = select(Message).options(*SUMMARY_LOAD_OPTIONS).where(Message.chat_id == chat_id)
     
     # Apply date filters if specified
     if start_date:
-        query = query.filter(Message.date_ts >= start_date)
+        stmt = stmt.where(Message.date_ts >= start_date)
     if end_date:
-        query = query.filter(Message.date_ts <= end_date)
+        stmt = stmt.where(Message.date_ts <= end_date)
     
     # Filter by topic if specified
     if thread_id:
-        query = query.filter(Message.message_thread_id == thread_id)
+        stmt = stmt.where(Message.message_thread_id == thread_id)
     
     # Order by date (ascending)
-    query = query.order_by(Message.date_ts.asc())
+    stmt = stmt.order_by(Message.date_ts.asc())
     
     # Apply limit
     if limit > 0:
-        query = query.limit(limit)
+        stmt = stmt.limit(limit)
     
-    return query.all()
+    return db.scalars(stmt).all()
 
 def get_recent_messages(db: Session, chat_id: int, days: int = 1, limit: int = 1000, thread_id: int = None) -> list[Message]:
     """
@@ -686,37 +1186,20 @@ def get_messages_reactions(db: Session, message_ids: list[int]) -> dict:
     if not message_ids:
         return {}
     
-    # Get all reactions for these messages
-    reactions = db.query(Reaction).filter(Reaction.message_internal_id.in_(message_ids)).all()
-    
+    # Counts come aggregated from the DB instead of loading every Reaction row
+    counts_stmt = (
+        select(Reaction.internal_message_id, Reaction.emoji, func.count())
+        .where(Reaction.internal_message_id.in_(message_ids))
+        .group_by(Reaction.internal_message_id, Reaction.emoji)
+    )
     results = {}
-    for reaction in reactions:
-        # Initialize message entry if it doesn't exist
-        if reaction.message_internal_id not in results:
-            results[reaction.message_internal_id] = {}
-        
-        # Initialize emoji count if it doesn't exist
-        if reaction.emoji not in results[reaction.message_internal_id]:
-            results[reaction.message_internal_id][reaction.emoji] = 0
-        
-        # Increment count
-        results[reaction.message_internal_id][reaction.emoji] += 1
+    for internal_message_id, emoji, count in db.execute(counts_stmt):
+        results.setdefault(internal_message_id, {})[emoji] = count
     
     return results
 
 # --- Contextual database session management ---
 
-def get_db():
-    """
-    Creates and returns a new SQLAlchemy session.
-    Use this in a FastAPI dependency.
-    """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 class ChatDatabase:
     """
     Database context manager for working with chat data.
@@ -732,29 +1215,34 @@ class ChatDatabase:
         self.db = None
     
     def __enter__(self):
-        self.db = SessionLocal()
+        # Thread-local session shared with run_db calls, released in __exit__
+        self.db = ScopedSession()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.db:
-            self.db.close()
+            ScopedSession.remove()
+            self.db = None
     
     # --- Chat methods ---
     def get_chat(self, chat_id: int) -> Chat | None:
         return get_chat(self.db, chat_id)
     
-    def get_or_create_chat(self, chat_data: dict) -> Chat | None:
-        return get_or_create_chat(self.db, chat_data)
+    def get_or_create_chat(self, chat_data: dict, commit: bool = True) -> Chat | None:
+        return get_or_create_chat(self.db, chat_data, commit)
     
     def deactivate_chat(self, chat_id: int) -> None:
         return deactivate_chat(self.db, chat_id)
     
+    def get_active_chat_ids(self) -> list[int]:
+        return get_active_chat_ids(self.db)
+    
     # --- User methods ---
     def get_user(self, user_id: int) -> User | None:
         return get_user(self.db, user_id)
     
-    def get_or_create_user(self, user_data: dict) -> User | None:
-        return get_or_create_user(self.db, user_data)
+    def get_or_create_user(self, user_data: dict, commit: bool = True) -> User | None:
+        return get_or_create_user(self.db, user_data, commit)
     
     # --- Message methods ---
     def get_message(self, chat_id: int, message_id: int) -> Message | None:
@@ -763,14 +1251,18 @@ class ChatDatabase:
     def create_message(self, message_data: dict) -> Message | None:
         return create_message(self.db, message_data)
     
+    def create_messages(self, messages_data: list[dict]) -> dict[tuple[int, int], int]:
+        return create_messages(self.db, messages_data)
+    
     def update_message(self, message_data: dict) -> Message | None:
         return update_message(self.db, message_data)
     
     def get_message_by_internal_id(self, internal_id: int) -> Message | None:
         return get_message_by_internal_id(self.db, internal_id)
     
-    def get_unsummarized_messages(self, chat_id: int, limit: int = 1000) -> list[Message]:
-        return get_unsummarized_messages(self.db, chat_id, limit)
+    def get_unsummarized_messages(self, chat_id: int, limit: int = 1000, since: datetime | None = None,
+                                  after: Message | None = None) -> list[Message]:
+        return get_unsummarized_messages(self.db, chat_id, limit, since, after)
     
     def mark_messages_as_summarized(self, internal_ids: list[int]) -> None:
         return mark_messages_as_summarized(self.db, internal_ids)
@@ -786,8 +1278,14 @@ class ChatDatabase:
         return get_messages_reactions(self.db, message_ids)
     
     # --- Summary methods ---
-    def create_summary(self, chat_id: int, text: str, message_ids: list[int]) -> Summary | None:
-        return create_summary(self.db, chat_id, text, message_ids)
+    def create_summary(self, chat_id: int, text: str, message_count: int,
+                       first_message_internal_id: int | None = None,
+                       last_message_internal_id: int | None = None) -> Summary | None:
+        return create_summary(self.db, chat_id, text, message_count,
+                              first_message_internal_id, last_message_internal_id)
+    
+    def mark_summary_as_published(self, summary_id: int) -> None:
+        return mark_summary_as_published(self.db, summary_id)
     
     def get_latest_summary(self, chat_id: int) -> Summary | None:
         return get_latest_summary(self.db, chat_id)
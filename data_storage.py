@@ -1,83 +1,253 @@
+import asyncio
+import atexit
 import json
 import os
 import logging
-from datetime import datetime
+import threading
+import time
+from typing import BinaryIO
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 DATA_DIR = "collected_data"
 
+# Буфер сбрасывается на диск, когда накопилось FLUSH_BYTES байт
+# или с прошлого сброса прошло больше FLUSH_INTERVAL секунд
+FLUSH_BYTES = 1 << 20
+FLUSH_INTERVAL = 1.0
+
+
+class _BatchWriter:
+    """Копит NDJSON-записи в памяти и дописывает их в файлы пачками.
+
+    Вместо отдельного файла на каждое обновление все записи одного типа за день
+    попадают в один файл `<тип>/<дата>.ndjson`, по одной строке на обновление.
+    Файлы остаются открытыми между сбросами; файл, в который ничего не писали
+    за целый сброс (например, вчерашний после полуночи), закрывается.
+    Фоновый поток сбрасывает буферы каждые FLUSH_INTERVAL секунд, чтобы последние
+    записи попадали на диск, даже если новых обновлений больше нет.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers: dict[str, bytearray] = {}
+        self._files: dict[str, BinaryIO] = {}
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._flusher: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def append(self, filepath: str, record: bytes):
+        with self._lock:
+            if self._flusher is None:
+                self._start_flusher()
+            buffer = self._buffers.get(filepath)
+            if buffer is None:
+                buffer = self._buffers[filepath] = bytearray()
+            buffer += record
+            self._size += len(record)
+            if self._size >= FLUSH_BYTES or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Сбрасывает буферы и закрывает все открытые файлы."""
+        self._stopped.set()
+        with self._lock:
+            self._flusher = None
+            self._flush_locked()
+            for filepath in list(self._files):
+                self._close_file(filepath)
+
+    def _start_flusher(self):
+        """Запускает фоновый сброс; поток создается при первой записи, а не при импорте модуля."""
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="data-storage-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(FLUSH_INTERVAL):
+            self.flush()
+
+    def _flush_locked(self):
+        for filepath in list(self._files):
+            if filepath not in self._buffers:
+                self._close_file(filepath)
+
+        for filepath, buffer in self._buffers.items():
+            try:
+                f = self._files.get(filepath)
+                if f is None:
+                    f = self._files[filepath] = open(filepath, 'ab')
+                f.write(buffer)
+                f.flush()
+            except IOError as e:
+                logger.error("Ошибка записи в файл %s: %s", filepath, e)
+                self._close_file(filepath)
+        self._buffers.clear()
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def _close_file(self, filepath: str):
+        f = self._files.pop(filepath, None)
+        if f is None:
+            return
+        try:
+            f.close()
+        except IOError as e:
+            logger.error("Ошибка закрытия файла %s: %s", filepath, e)
+
+
+# Директории, которые уже были созданы в этом процессе
+_CREATED_DIRS: set[str] = set()
+
+_writer = _BatchWriter()
+atexit.register(_writer.close)
+
+
+def flush_data():
+    """Принудительно сбрасывает накопленные записи на диск."""
+    _writer.flush()
+
 def ensure_data_dir():
     """Создает директорию для хранения данных, если она не существует."""
     if not os.path.exists(DATA_DIR):
         try:
             os.makedirs(DATA_DIR)
-            logger.info(f"Создана директория для данных: {DATA_DIR}")
+            logger.info("Создана директория для данных: %s", DATA_DIR)
         except OSError as e:
-            logger.error(f"Не удалось создать директорию {DATA_DIR}: {e}")
+            logger.error("Не удалось создать директорию %s: %s", DATA_DIR, e)
+
+def _ensure_dir(path: str):
+    """Создает директорию (вместе с DATA_DIR) один раз за процесс."""
+    if path not in _CREATED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _CREATED_DIRS.add(path)
+
+# Последняя отформатированная секунда: (секунда, дата, время без микросекунд).
+# Хранится одним кортежем, чтобы параллельные вызовы не смешали дату и время разных секунд
+_last_stamp = (0, "", "")
+
+def _timestamp() -> tuple[str, str]:
+    """Возвращает дату ("%Y-%m-%d") и время ("%H-%M-%S-%f") текущего момента.
+
+    Дата и время форматируются не чаще раза в секунду, микросекунды берутся из time.time_ns().
+    """
+    global _last_stamp
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    stamp = _last_stamp
+    if stamp[0] != sec:
+        now = time.localtime(sec)
+        stamp = _last_stamp = (
+            sec,
+            f"{now.tm_year:04d}-{now.tm_mon:02d}-{now.tm_mday:02d}",
+            f"{now.tm_hour:02d}-{now.tm_min:02d}-{now.tm_sec:02d}",
+        )
+    return stamp[1], f"{stamp[2]}-{ns // 1000:06d}"
+
+def encode_data(data: dict) -> bytes:
+    """Сериализует данные в JSON (UTF-8).
+
+    Результат можно передать в save_update_data / save_raw_update вместо словаря,
+    чтобы одно и то же обновление не кодировалось повторно.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# Путь к текущему дневному файлу для каждой поддиректории: {поддиректория: (дата, путь)}
+_daily_paths: dict[str, tuple[str, str]] = {}
+
+def _daily_path(subdir: str, date_str: str) -> str:
+    """Возвращает путь `<DATA_DIR>/<subdir>/<дата>.ndjson`, собирая его только при смене даты."""
+    cached = _daily_paths.get(subdir)
+    if cached is not None and cached[0] == date_str:
+        return cached[1]
+    directory = os.path.join(DATA_DIR, subdir)
+    _ensure_dir(directory)
+    filepath = os.path.join(directory, f"{date_str}.ndjson")
+    _daily_paths[subdir] = (date_str, filepath)
+    return filepath
+
+def _encode_record(time_str: str, data: dict | bytes) -> bytes:
+    """Собирает одну NDJSON-строку: время сохранения и сами данные."""
+    payload = data if isinstance(data, bytes) else encode_data(data)
+    return b'{"time":"' + time_str.encode('ascii') + b'","data":' + payload + b'}\n'
 
-def save_update_data(update_type: str, data: dict):
-    """Сохраняет данные обновления (сообщение, обновление участника и т.д.) в JSON-файл.
+def save_update_data(update_type: str, data: dict | bytes):
+    """Сохраняет данные обновления (сообщение, обновление участника и т.д.) в NDJSON-файл.
+
+    Запись попадает в буфер и дописывается в `<DATA_DIR>/<тип>/<дата>.ndjson`
+    при очередном сбросе (см. `flush_data`).
 
     Args:
         update_type: Тип обновления (например, 'message', 'chat_member').
-        data: Словарь с данными для сохранения.
+        data: Словарь с данными для сохранения или результат encode_data().
     """
-    ensure_data_dir()
-    now = datetime.now()
-    date_str = now.strftime("%Y-%m-%d")
-    time_str = now.strftime("%H-%M-%S-%f")
-    
-    # Создаем поддиректорию для типа обновления и даты
-    type_dir = os.path.join(DATA_DIR, update_type)
-    date_dir = os.path.join(type_dir, date_str)
-    os.makedirs(date_dir, exist_ok=True)
-    
-    # Формируем имя файла
-    chat_id = data.get('chat', {}).get('id') or data.get('message', {}).get('chat', {}).get('id')
-    update_id = data.get('update_id')
-    filename_parts = [time_str]
-    if chat_id:
-        filename_parts.append(f"chat_{chat_id}")
-    if update_id:
-        filename_parts.append(f"update_{update_id}")
-        
-    filename = "__".join(str(p) for p in filename_parts) + ".json"
-    filepath = os.path.join(date_dir, filename)
+    date_str, time_str = _timestamp()
+    filepath = _daily_path(update_type, date_str)
 
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        # logger.debug(f"Данные типа '{update_type}' сохранены в {filepath}")
+        _writer.append(filepath, _encode_record(time_str, data))
     except TypeError as e:
-        logger.error(f"Ошибка сериализации JSON при сохранении в {filepath}: {e}")
-    except IOError as e:
-        logger.error(f"Ошибка записи в файл {filepath}: {e}")
+        logger.error("Ошибка сериализации JSON при сохранении в %s: %s", filepath, e)
 
-def save_raw_update(update_data: dict):
+def save_raw_update(update_data: dict | bytes):
     """Сохраняет полное необработанное обновление от Telegram.
+
+    Запись дописывается в `<DATA_DIR>/raw_updates/<дата>.ndjson`.
     
     Args:
-        update_data: Словарь с данными обновления.
+        update_data: Словарь с данными обновления или результат encode_data().
     """
-    ensure_data_dir()
-    now = datetime.now()
-    date_str = now.strftime("%Y-%m-%d")
-    time_str = now.strftime("%H-%M-%S-%f")
-    
-    # Директория для сырых обновлений
-    raw_dir = os.path.join(DATA_DIR, "raw_updates", date_str)
-    os.makedirs(raw_dir, exist_ok=True)
-    
-    update_id = update_data.get('update_id')
-    filename = f"{time_str}__update_{update_id}.json" if update_id else f"{time_str}__update.json"
-    filepath = os.path.join(raw_dir, filename)
+    date_str, time_str = _timestamp()
+    filepath = _daily_path("raw_updates", date_str)
 
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(update_data, f, ensure_ascii=False, indent=4)
-        # logger.debug(f"Сырое обновление {update_id} сохранено в {filepath}")
+        _writer.append(filepath, _encode_record(time_str, update_data))
     except TypeError as e:
-        logger.error(f"Ошибка сериализации JSON при сохранении сырого обновления в {filepath}: {e}")
-    except IOError as e:
-        logger.error(f"Ошибка записи в файл сырого обновления {filepath}: {e}") 
\ No newline at end of file
+        logger.error("Ошибка сериализации JSON при сохранении сырого обновления в %s: %s", filepath, e)
+
+def save_update(update_type: str, raw_data: dict | bytes, data: dict | bytes | None = None):
+    """Сохраняет сырое обновление и данные обновления одним вызовом.
+
+    Заменяет пару save_raw_update + save_update_data: время берется один раз, а если
+    `data` не передан или совпадает с `raw_data`, обновление сериализуется только однажды.
+
+    Args:
+        update_type: Тип обновления (например, 'message', 'chat_member').
+        raw_data: Полное обновление от Telegram (словарь или результат encode_data()).
+        data: Данные для файла типа обновления; по умолчанию — то же, что raw_data.
+    """
+    date_str, time_str = _timestamp()
+    raw_path = _daily_path("raw_updates", date_str)
+    filepath = _daily_path(update_type, date_str)
+
+    try:
+        raw_record = _encode_record(time_str, raw_data)
+        record = raw_record if data is None or data is raw_data else _encode_record(time_str, data)
+    except TypeError as e:
+        logger.error("Ошибка сериализации JSON при сохранении обновления типа '%s': %s", update_type, e)
+        return
+    _writer.append(raw_path, raw_record)
+    _writer.append(filepath, record)
+
+async def save_update_data_async(update_type: str, data: dict | bytes):
+    """Асинхронная версия save_update_data: сериализация и возможный сброс на диск выполняются в отдельном потоке."""
+    await asyncio.to_thread(save_update_data, update_type, data)
+
+async def save_raw_update_async(update_data: dict | bytes):
+    """Асинхронная версия save_raw_update: запись выполняется в отдельном потоке."""
+    await asyncio.to_thread(save_raw_update, update_data)
+
+async def save_update_async(update_type: str, raw_data: dict | bytes, data: dict | bytes | None = None):
+    """Асинхронная версия save_update: запись выполняется в отдельном потоке."""
+    await asyncio.to_thread(save_update, update_type, raw_data, data)
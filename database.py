@@ -1,38 +1,162 @@
+import hashlib
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-from config import DATABASE_URI
+from config import DATABASE_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
 
 logger = logging.getLogger(__name__)
 
 # Создаем движок SQLAlchemy
 try:
-    engine = create_engine(DATABASE_URI, echo=False) # echo=True для отладки SQL-запросов
+    engine = create_engine(
+        DATABASE_URI,
+        echo=False, # echo=True для отладки SQL-запросов
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE, # Переоткрываем долгоживущие соединения
+        pool_use_lifo=True, # Отдаем последнее возвращенное соединение: при малой нагрузке работают несколько "теплых" соединений, остальные простаивают и переоткрываются по pool_recycle
+        pool_pre_ping=False # Соединение с файлом SQLite не обрывается, лишний SELECT 1 при каждой выдаче из пула не нужен
+    )
 except Exception as e:
-    logger.error(f"Ошибка при создании движка SQLAlchemy: {e}")
+    logger.error("Ошибка при создании движка SQLAlchemy: %s", e)
     raise
 
+# Настройки SQLite, применяемые к каждому новому соединению:
+# WAL не блокирует чтение при записи, synchronous=NORMAL в режиме WAL делает fsync только при чекпоинтах
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456, # 256 МБ
+    "cache_size": -16000, # ~16 МБ (отрицательное значение задается в КиБ)
+    "journal_size_limit": 6144000,
+}
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
 # Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: значения, записанные или полученные через RETURNING, остаются доступны после commit
+# без повторного SELECT (в том числе у объектов, отсоединенных после ScopedSession.remove())
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Сессия, общая для всех вызовов в пределах одного потока; освобождается через ScopedSession.remove()
+ScopedSession = scoped_session(SessionLocal)
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
-def get_db():
-    """Зависимость для получения сессии базы данных."""
-    db = SessionLocal()
+def create_tables():
+    """Создает все таблицы в базе данных.
+
+    Если схема моделей не менялась с прошлого запуска (см. schema_hash()), create_all и upgrade_schema пропускаются.
+    """
     try:
-        yield db
-    finally:
-        db.close()
+        current_hash = schema_hash()
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_meta (key TEXT PRIMARY KEY, value TEXT)")
+            stored_hash = connection.exec_driver_sql("SELECT value FROM schema_meta WHERE key = 'schema_hash'").scalar()
+        if stored_hash == current_hash:
+            logger.info("Схема БД не изменилась, создание таблиц пропущено.")
+            optimize_database()
+        else:
+            logger.info("Создание таблиц базы данных...")
+            Base.metadata.create_all(bind=engine)
+            upgrade_schema()
+            with engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('schema_hash', ?)", (current_hash,)
+                )
+            logger.info("Таблицы успешно созданы.")
+            analyze_database()
+    except Exception as e:
+        logger.error("Ошибка при создании таблиц: %s", e)
+        raise 
 
-def create_tables():
-    """Создает все таблицы в базе данных."""
+def schema_hash() -> str:
+    """Хэш текущей схемы: DDL таблиц и индексов моделей, а также списки миграций ниже."""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(str(CreateTable(table).compile(dialect=engine.dialect)))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            parts.append(str(CreateIndex(index).compile(dialect=engine.dialect)))
+    parts.extend(repr(upgrade) for upgrade in SCHEMA_UPGRADES)
+    parts.extend(OBSOLETE_INDEXES)
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+# Колонки, добавленные после первой версии схемы: (таблица, колонка, определение для ALTER TABLE ADD COLUMN).
+# SQLite не умеет добавлять STORED-колонки, поэтому вычисляемые колонки в старых базах добавляются как VIRTUAL
+SCHEMA_UPGRADES = [
+    ("messages", "is_question", "BOOLEAN GENERATED ALWAYS AS (coalesce(text, '') LIKE '%?') VIRTUAL"),
+]
+
+# Индексы, которые больше не нужны: непросуммированные сообщения ищутся по частичному индексу
+# ix_messages_unsummarized_chat_date, а полные индексы по summarized только замедляют запись
+OBSOLETE_INDEXES = [
+    "ix_messages_summarized",
+    "ix_messages_chat_summarized_date",
+    # Заменен на ix_messages_chat_thread_date: summarized перед date_ts мешал выборке по диапазону дат в топике
+    "ix_messages_chat_thread_summarized_date",
+]
+
+def upgrade_schema():
+    """Доводит существующую базу до текущей схемы: create_all не добавляет колонки и индексы в уже созданные таблицы."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table_name, column_name, column_ddl in SCHEMA_UPGRADES:
+            # Таблица может отсутствовать, если модели не были импортированы до create_tables()
+            if not inspector.has_table(table_name):
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table_name)}
+            if column_name not in existing_columns:
+                logger.info("Добавление колонки %s.%s", table_name, column_name)
+                connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}")
+        # Индексы создаются только если их еще нет
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        for index_name in OBSOLETE_INDEXES:
+            connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+
+def analyze_database():
+    """Обновляет статистику планировщика SQLite."""
+    if engine.dialect.name == "sqlite":
+        # Без статистики планировщик не знает, что частичный индекс ix_messages_unsummarized_chat_date
+        # намного меньше ix_messages_chat_date, и может выбрать полный. analysis_limit ограничивает
+        # число просматриваемых строк индекса, чтобы ANALYZE на большой базе не задерживал старт
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("PRAGMA analysis_limit=1000")
+            connection.exec_driver_sql("ANALYZE")
+
+def optimize_database():
+    """Обновляет статистику SQLite только для таблиц, где она устарела (PRAGMA optimize)."""
+    if engine.dialect.name == "sqlite":
+        # Статистика уже собрана при создании схемы; PRAGMA optimize запускает ANALYZE лишь там,
+        # где данных стало заметно больше, и в пределах analysis_limit
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("PRAGMA analysis_limit=1000")
+            connection.exec_driver_sql("PRAGMA optimize")
+
+def warm_up_pool():
+    """Заранее открывает DB_POOL_SIZE соединений, чтобы первые запросы бота не тратили время на подключение и PRAGMA."""
+    connections = []
     try:
-        logger.info("Создание таблиц базы данных...")
-        Base.metadata.create_all(bind=engine)
-        logger.info("Таблицы успешно созданы.")
+        for _ in range(DB_POOL_SIZE):
+            connections.append(engine.connect())
+        logger.info("Открыто соединений с БД: %s", len(connections))
     except Exception as e:
-        logger.error(f"Ошибка при создании таблиц: {e}")
-        raise 
\ No newline at end of file
+        logger.warning("Не удалось заранее открыть соединения с БД: %s", e)
+    finally:
+        # Соединения возвращаются в пул и остаются открытыми
+        for connection in connections:
+            connection.close()
@@ -3,6 +3,7 @@ import logging
 import os
 import argparse
 from database import create_tables, engine # Импортируем функцию создания таблиц
+import models # Регистрирует модели в Base.metadata, иначе create_tables() не создаст ни одной таблицы
 from config import DB_PATH
 
 logging.basicConfig(level=logging.INFO)
@@ -1,7 +1,7 @@
 import logging
 from config import BOT_TOKEN, CHANNEL_ID, LOG_LEVEL
 from telegram_bot import ChatSummarizerBot
-from database import create_tables
+from database import create_tables, warm_up_pool
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,6 +22,7 @@ def main():
     except Exception as e:
         logger.error(f"Failed to create database tables: {e}")
         return
+    warm_up_pool()
 
     try:
         bot = ChatSummarizerBot(BOT_TOKEN, CHANNEL_ID)
@@ -1,11 +1,46 @@
 import datetime
+import json
+import zlib
 from typing import Optional
 from sqlalchemy import (Column, Integer, String, Boolean, DateTime, 
-                        ForeignKey, JSON, Text, BigInteger, UniqueConstraint)
+                        ForeignKey, JSON, Text, BigInteger, UniqueConstraint, Index, Computed, LargeBinary)
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.sql.expression import text as sql_text # Message has its own 'text' column
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from sqlalchemy.sql import func
 from database import Base
 
+try:
+    import orjson
+except ImportError: # Optional; stdlib json is used without it
+    orjson = None
+
+class CompressedJSON(TypeDecorator):
+    """JSON stored as a zlib-compressed blob. Rows written as plain JSON text are still readable."""
+    impl = LargeBinary
+    cache_ok = True
+
+    compression_level = 3 # Fast; raw Telegram updates still shrink several times
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if orjson is not None:
+            data = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return zlib.compress(data, self.compression_level)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str): # Written by the former JSON column
+            return json.loads(value)
+        try:
+            value = zlib.decompress(value)
+        except zlib.error:
+            pass
+        return orjson.loads(value) if orjson is not None else json.loads(value)
+
 # Using new Mapped syntax for typing
 
 class Chat(Base):
@@ -16,10 +51,10 @@ class Chat(Base):
     title: Mapped[str | None] = mapped_column(String(255), nullable=True)
     description: Mapped[str | None] = mapped_column(Text, nullable=True)
     member_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
-    first_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now())
-    last_activity_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+    first_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+    last_activity_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
-    raw_data: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    raw_data: Mapped[dict | None] = mapped_column(CompressedJSON, nullable=True, deferred=True) # Loaded on first access
 
     # Relationships
     messages: Mapped[list["Message"]] = relationship(back_populates="chat", foreign_keys="[Message.chat_id]")
@@ -38,9 +73,9 @@ class User(Base):
     is_bot: Mapped[bool] = mapped_column(Boolean, default=False)
     is_premium: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
     language_code: Mapped[str | None] = mapped_column(String(10), nullable=True)
-    first_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now())
-    last_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
-    raw_data: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    first_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+    last_seen_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    raw_data: Mapped[dict | None] = mapped_column(CompressedJSON, nullable=True, deferred=True) # Loaded on first access
 
     # Relationships
     messages: Mapped[list["Message"]] = relationship(back_populates="user", foreign_keys="[Message.user_id]")
@@ -75,12 +110,13 @@ class Message(Base):
     media_file_unique_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
     has_media: Mapped[bool] = mapped_column(Boolean, default=False)
 
-    # Additional flags for analysis (can be removed if analysis is external)
-    # is_question: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Additional flags for analysis, computed by the DB when the row is written
+    is_question: Mapped[bool] = mapped_column(Boolean, Computed("coalesce(text, '') LIKE '%?'", persisted=True))
     # is_command: Mapped[bool] = mapped_column(Boolean, default=False)
-    summarized: Mapped[bool] = mapped_column(Boolean, default=False, index=True) # Index for finding unprocessed messages
+    summarized: Mapped[bool] = mapped_column(Boolean, default=False) # Unprocessed messages are found via ix_messages_unsummarized_chat_date
     
-    raw_data: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    # Full Telegram payload, kept for audit only: not loaded with the message, read on first access
+    raw_data: Mapped[dict | None] = mapped_column(CompressedJSON, nullable=True, deferred=True)
 
     # Relationships
     chat: Mapped["Chat"] = relationship(back_populates="messages", foreign_keys=[chat_id])
@@ -90,8 +126,16 @@ class Message(Base):
     reply_to_message: Mapped[Optional["Message"]] = relationship(remote_side=[internal_id])
     reactions: Mapped[list["Reaction"]] = relationship(back_populates="message", cascade="all, delete-orphan")
 
-    # Unique index for message_id within chat_id
-    __table_args__ = (UniqueConstraint('chat_id', 'message_id', name='uq_chat_message'),)
+    __table_args__ = (
+        # Unique index for message_id within chat_id, also used by ON CONFLICT upserts
+        UniqueConstraint('chat_id', 'message_id', name='uq_chat_message'),
+        # Index for date range queries within a chat
+        Index('ix_messages_chat_date', 'chat_id', 'date_ts'),
+        # Index for date range queries within a topic
+        Index('ix_messages_chat_thread_date', 'chat_id', 'message_thread_id', 'date_ts'),
+        # Partial index holding only messages still waiting for a summary; rows leave it once marked as summarized
+        Index('ix_messages_unsummarized_chat_date', 'chat_id', 'date_ts', sqlite_where=sql_text('summarized = 0')),
+    )
 
     def __repr__(self):
         preview = (self.text or self.caption or f"[{self.media_type or 'media'}]")[:30]
@@ -103,7 +147,7 @@ class Reaction(Base):
     internal_message_id: Mapped[int] = mapped_column(Integer, ForeignKey("messages.internal_id"), primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.user_id"), primary_key=True)
     emoji: Mapped[str] = mapped_column(String(50), primary_key=True) # Emoji or custom_emoji_id
-    added_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now())
+    added_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
 
     # Relationships
     message: Mapped["Message"] = relationship(back_populates="reactions")
@@ -121,10 +165,15 @@ class Summary(Base):
     message_count: Mapped[int] = mapped_column(Integer)
     first_message_internal_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("messages.internal_id"), nullable=True)
     last_message_internal_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("messages.internal_id"), nullable=True)
-    created_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now())
+    created_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
     published_ts: Mapped[datetime.datetime | None] = mapped_column(DateTime, nullable=True)
     published: Mapped[bool] = mapped_column(Boolean, default=False)
 
+    __table_args__ = (
+        # Index for fetching the latest summary of a chat
+        Index('ix_summaries_chat_created', 'chat_id', 'created_ts'),
+    )
+
     # Relationships
     chat: Mapped["Chat"] = relationship(back_populates="summaries")
     # Can add relationships with first/last message if needed
@@ -138,6 +187,6 @@ class Summary(Base):
 # class RawUpdate(Base):
 #     __tablename__ = "raw_updates"
 #     update_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
-#     received_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=func.now())
+#     received_ts: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
 #     update_type: Mapped[str | None] = mapped_column(String(50), nullable=True)
 #     raw_data: Mapped[dict] = mapped_column(JSON) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import logging
 import asyncio
@@ -12,39 +13,168 @@ from telegram.ext import (
     MessageReactionHandler, JobQueue
 )
 from telegram.ext.filters import BaseFilter
-from telegram.constants import ChatAction, ParseMode
+from telegram.constants import ChatAction, ParseMode, MessageLimit
+from telegram.error import RetryAfter
 
-from database import SessionLocal, get_db # Import session and dependency
+from database import ScopedSession # Thread-local session registry
 import crud # Import CRUD functions
 import models # Import models (for type hinting)
 # If summarization is needed, uncomment:
 # from yandex_gpt_summarizer import YandexGPTSummarizer
-from config import BOT_TOKEN, CHANNEL_ID, MIN_MESSAGES, SUMMARY_TIME # Add SUMMARY_TIME
+from config import (BOT_TOKEN, CHANNEL_ID, MIN_MESSAGES, SUMMARY_TIME, # Add SUMMARY_TIME
+                    MESSAGE_BATCH_SIZE, MESSAGE_FLUSH_INTERVAL, MESSAGE_QUEUE_SIZE)
 
 logger = logging.getLogger(__name__)
 
+# Replies to static commands
+START_TEXT = "Hi! I'm a chat summary bot. Add me to a chat."
+HELP_TEXT = "Commands: /start, /help, /summarize [optional days], /stats"
+
+# How many times a channel post is retried after Telegram flood control (429)
+SEND_MAX_RETRIES = 3
+
 # --- Helper function to get session --- 
 def get_session() -> Session:
-    """Creates and returns a new SQLAlchemy session."""
-    return SessionLocal()
+    """Returns the session of the current thread, creating it on first use."""
+    return ScopedSession()
+
+def _run_in_session(func, *args, **kwargs):
+    """Calls func(db, *args, **kwargs) with the thread's session and releases it afterwards."""
+    db = get_session()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        ScopedSession.remove()
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking CRUD call in a worker thread so DB I/O doesn't stall the event loop."""
+    return await asyncio.to_thread(_run_in_session, func, *args, **kwargs)
+
+# Tags and character entities of Telegram HTML; a message is never split inside them
+_HTML_TOKEN_RE = re.compile(r'(<[^>]*>|&#?\w+;)')
+_HTML_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)')
+
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list[str]:
+    """
+    Splits HTML text into parts of at most limit characters, preferring line boundaries.
+    Tags open at a split are closed at the end of the part and reopened at the start of the next one,
+    so every part is valid HTML on its own.
+    """
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    open_tags = [] # (name, opening tag) of the tags enclosing the current position
+    current = ""
+    has_text = False # Whether the current part has text besides tags
+    # End of the last text in the current part and the tags open there; tags that follow it
+    # are moved to the next part instead of leaving empty elements at the end of this one
+    text_end = 0
+    text_tags = []
+
+    def closing_tags(tags: list) -> str:
+        return "".join(f"</{name}>" for name, _ in reversed(tags))
+
+    def add_text(piece: str):
+        nonlocal current, has_text, text_end, text_tags
+        current += piece
+        has_text = True
+        text_end = len(current)
+        text_tags = list(open_tags)
+
+    def start_new_part():
+        nonlocal current, has_text
+        parts.append(current[:text_end] + closing_tags(text_tags))
+        current = "".join(tag for _, tag in open_tags)
+        has_text = False
+
+    for token in _HTML_TOKEN_RE.split(text):
+        if not token:
+            continue
+        tag = _HTML_TAG_RE.match(token)
+        if tag:
+            is_closing, name = tag.groups()
+            if not is_closing:
+                # An opening tag also needs room for its closing tag at the end of the part
+                needed = len(token) + len(name) + 3
+                if len(current) + needed + len(closing_tags(open_tags)) > limit and has_text:
+                    start_new_part()
+                open_tags.append((name, token))
+                current += token
+            else:
+                current += token
+                for i in range(len(open_tags) - 1, -1, -1):
+                    if open_tags[i][0] == name:
+                        del open_tags[i]
+                        break
+            continue
+
+        is_entity = token.startswith('&') and token.endswith(';')
+        for piece in ([token] if is_entity else token.splitlines(keepends=True)):
+            while piece:
+                room = limit - len(current) - len(closing_tags(open_tags))
+                if len(piece) <= room:
+                    add_text(piece)
+                    break
+                if has_text:
+                    start_new_part()
+                    continue
+                # A single line longer than a whole part is cut hard
+                room = max(room, 1)
+                add_text(piece[:room])
+                piece = piece[room:]
+                start_new_part()
+    if has_text:
+        parts.append(current + closing_tags(open_tags))
+    return parts
 
 class ChatSummarizerBot:
     def __init__(self, token, channel_id):
         self.token = token
         self.channel_id = channel_id
         # self.summarizer = YandexGPTSummarizer() # If summarization is needed
-        self.app = Application.builder().token(token).build()
+        self.app = (
+            Application.builder()
+            .token(token)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self.job_queue: JobQueue = self.app.job_queue
         
+        # Incoming messages are queued and written to DB in batches by a single writer task
+        self._message_queue: asyncio.Queue[dict | asyncio.Future] = asyncio.Queue(maxsize=MESSAGE_QUEUE_SIZE)
+        self._writer_task: asyncio.Task | None = None
+        
+        # Channel posts go out one at a time, so summaries sent back to back (e.g. several /summarize)
+        # don't burst into the channel's flood limit
+        self._send_lock = asyncio.Lock()
+        
         self.register_handlers()
         # self.schedule_daily_summary() # If automatic summarization is needed
+
+    async def _post_init(self, application: Application):
+        """Starts the message writer task."""
+        self._writer_task = asyncio.create_task(self._message_writer())
+
+    async def _post_shutdown(self, application: Application):
+        """Writes remaining queued messages and stops the writer task."""
+        if not self._writer_task:
+            return
+        await self.flush_message_buffer()
+        self._writer_task.cancel()
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
             
     def register_handlers(self):
         """Register handlers"""
         # Commands
         self.app.add_handler(CommandHandler("start", self.start_command))
         self.app.add_handler(CommandHandler("help", self.help_command))
-        self.app.add_handler(CommandHandler("summarize", self.manual_summarize))
+        # Summary creation waits for the message writer, reads the DB and sends messages;
+        # block=False lets updates that arrive meanwhile be processed instead of queuing behind it
+        self.app.add_handler(CommandHandler("summarize", self.manual_summarize, block=False))
         self.app.add_handler(CommandHandler("stats", self.stats_command))
         
         # Messages and events
@@ -78,10 +208,10 @@ class ChatSummarizerBot:
     
     # --- Command handlers ---
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text("Hi! I'm a chat summary bot. Add me to a chat.")
+        await update.message.reply_text(START_TEXT)
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text("Commands: /start, /help, /summarize [optional days], /stats")
+        await update.message.reply_text(HELP_TEXT)
         
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Shows chat statistics."""
@@ -139,14 +269,63 @@ class ChatSummarizerBot:
         message_dict['chat'] = chat.to_dict()
         message_dict['from'] = user.to_dict()
         
-        db = get_session()
-        try:
-            created_msg = crud.create_message(db, message_dict)
-            if created_msg:
-                # logger.debug(f"Message {created_msg.internal_id} saved.")
+        await self._message_queue.put(message_dict)
+
+    async def flush_message_buffer(self):
+        """Waits until messages queued before this call have been written to DB."""
+        if not self._writer_task or self._writer_task.done():
+            return
+        # The writer resolves the marker after storing everything queued ahead of it;
+        # messages arriving later are not waited for
+        flushed = asyncio.get_running_loop().create_future()
+        await self._message_queue.put(flushed)
+        await flushed
+
+    async def _collect_batch(self) -> tuple[list[dict], list[asyncio.Future]]:
+        """
+        Waits for a message, then gathers more for up to MESSAGE_FLUSH_INTERVAL seconds or MESSAGE_BATCH_SIZE messages.
+        A flush marker ends the batch right away; markers are returned separately.
+        """
+        batch = []
+        flush_markers = []
+        loop = asyncio.get_running_loop()
+        item = await self._message_queue.get()
+        deadline = loop.time() + MESSAGE_FLUSH_INTERVAL
+        while True:
+            if isinstance(item, asyncio.Future):
+                flush_markers.append(item)
+                break
+            batch.append(item)
+            if len(batch) >= MESSAGE_BATCH_SIZE:
+                break
+            try:
+                item = self._message_queue.get_nowait()
+                continue
+            except asyncio.QueueEmpty:
                 pass
-        finally:
-            db.close()
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._message_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch, flush_markers
+
+    async def _message_writer(self):
+        """Drains the message queue and writes each batch with a single insert."""
+        while True:
+            batch, flush_markers = await self._collect_batch()
+            try:
+                if batch:
+                    stored_ids = await run_db(crud.create_messages, batch)
+                    # logger.debug("%s of %s queued messages saved.", len(stored_ids), len(batch))
+            except Exception as e:
+                logger.error("Error writing message batch: %s", e)
+            finally:
+                for marker in flush_markers:
+                    if not marker.done():
+                        marker.set_result(None)
     
     async def store_edited_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Processes and updates an edited message."""
@@ -161,29 +340,21 @@ class ChatSummarizerBot:
             
         # Convert Telegram objects to dictionaries
         message_dict = message.to_dict()
-        # Add chat and from inside message dictionary for update_message
+        # Add chat and from inside message dictionary for create_messages
         message_dict['chat'] = chat.to_dict()
         message_dict['from'] = user.to_dict()
         
-        db = get_session()
-        try:
-            # Update message in database
-            updated_msg = crud.update_message(db, message_dict)
-            if updated_msg:
-                # logger.debug(f"Message {updated_msg.internal_id} updated.")
-                pass
-        finally:
-            db.close()
+        # Edits go through the same queue as new messages, so an edit of a message that is still queued
+        # is written after it; create_messages updates the stored copy when edit_date is newer
+        await self._message_queue.put(message_dict)
 
     async def reaction_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Processes reaction updates."""
         if update.message_reaction:
-            db = get_session()
-            try:
-                crud.update_reactions(db, update.message_reaction.to_dict())
-                # logger.debug("Reactions updated.")
-            finally:
-                db.close()
+            # The reacted message may still be waiting in the message queue
+            await self.flush_message_buffer()
+            await run_db(crud.update_reactions, update.message_reaction.to_dict())
+            # logger.debug("Reactions updated.")
 
     async def track_chats_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Tracks bot addition/removal from chats."""
@@ -195,58 +366,51 @@ class ChatSummarizerBot:
         old_status = result.old_chat_member.status
         user_who_changed = result.from_user # User who changed bot's status
         
-        db = get_session()
-        try:
-            # Ensure the user who changed status exists
-            if user_who_changed:
-                 crud.get_or_create_user(db, user_who_changed.to_dict())
-                 
-            if new_status in ["member", "administrator"] and old_status not in ["member", "administrator"]:
-                logger.info(f"Bot added to chat: {chat.title} ({chat.id})")
-                # Try to get member_count, but don't fail if unable
-                member_count = None
-                try:
-                    member_count = await context.bot.get_chat_member_count(chat.id)
-                except Exception as e:
-                    logger.warning(f"Failed to get member_count for chat {chat.id}: {e}")
-                chat_data = chat.to_dict()
-                chat_data['member_count'] = member_count # Add member_count if received
-                crud.get_or_create_chat(db, chat_data)
-            elif new_status in ["left", "kicked"] and old_status not in ["left", "kicked"]:
-                logger.info(f"Bot removed/blocked from chat: {chat.title} ({chat.id})")
-                crud.deactivate_chat(db, chat.id)
-            else:
-                # Other status changes (e.g., promotion to admin) - update chat
-                 logger.info(f"Bot status changed in chat: {chat.title} ({chat.id}) -> {new_status}")
-                 crud.get_or_create_chat(db, chat.to_dict())
-        finally:
-            db.close()
+        # Ensure the user who changed status exists
+        if user_who_changed:
+             await run_db(crud.get_or_create_user, user_who_changed.to_dict())
+             
+        if new_status in ["member", "administrator"] and old_status not in ["member", "administrator"]:
+            logger.info("Bot added to chat: %s (%s)", chat.title, chat.id)
+            # Try to get member_count, but don't fail if unable
+            member_count = None
+            try:
+                member_count = await context.bot.get_chat_member_count(chat.id)
+            except Exception as e:
+                logger.warning("Failed to get member_count for chat %s: %s", chat.id, e)
+            chat_data = chat.to_dict()
+            chat_data['member_count'] = member_count # Add member_count if received
+            await run_db(crud.get_or_create_chat, chat_data)
+        elif new_status in ["left", "kicked"] and old_status not in ["left", "kicked"]:
+            logger.info("Bot removed/blocked from chat: %s (%s)", chat.title, chat.id)
+            await run_db(crud.deactivate_chat, chat.id)
+        else:
+            # Other status changes (e.g., promotion to admin) - update chat
+             logger.info("Bot status changed in chat: %s (%s) -> %s", chat.title, chat.id, new_status)
+             await run_db(crud.get_or_create_chat, chat.to_dict())
             
     async def new_member_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Processes new members added to chat."""
         if update.message and update.message.new_chat_members:
-            db = get_session()
-            try:
-                 chat_data = update.effective_chat.to_dict()
-                 crud.get_or_create_chat(db, chat_data)
-                 for member_data in update.message.new_chat_members:
-                      crud.get_or_create_user(db, member_data.to_dict())
-                      logger.info(f"User {member_data.username or member_data.id} added to chat {chat_data.get('id')}")
-            finally: 
-                db.close()
+            chat_data = update.effective_chat.to_dict()
+            new_members = update.message.new_chat_members
+
+            def store_members(db: Session):
+                crud.get_or_create_chat(db, chat_data)
+                for member_data in new_members:
+                    crud.get_or_create_user(db, member_data.to_dict())
+                    logger.info("User %s added to chat %s", member_data.username or member_data.id, chat_data.get('id'))
+
+            await run_db(store_members)
                 
     async def left_member_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Processes member leaving/removal from chat."""
         if update.message and update.message.left_chat_member:
-            db = get_session()
-            try:
-                 chat_data = update.effective_chat.to_dict()
-                 crud.get_or_create_chat(db, chat_data)
-                 member_data = update.message.left_chat_member
-                 # Don't delete user, just log
-                 logger.info(f"User {member_data.username or member_data.id} left/removed from chat {chat_data.get('id')}")
-            finally: 
-                 db.close()
+            chat_data = update.effective_chat.to_dict()
+            await run_db(crud.get_or_create_chat, chat_data)
+            member_data = update.message.left_chat_member
+            # Don't delete user, just log
+            logger.info("User %s left/removed from chat %s", member_data.username or member_data.id, chat_data.get('id'))
                  
     def schedule_daily_summary(self):
         """Schedules daily summary generation."""
@@ -260,7 +424,7 @@ class ChatSummarizerBot:
             chat_id=self.channel_id,  # Will summarize for the channel_id if provided
             name="daily_summary"
         )
-        logger.info(f"Daily summary scheduled at {SUMMARY_TIME}")
+        logger.info("Daily summary scheduled at %s", SUMMARY_TIME)
 
     async def create_and_send_summary_job(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int | None = None, days: int = 1):
         """Creates and sends summary for a chat - can be called as a job."""
@@ -269,28 +433,26 @@ class ChatSummarizerBot:
             logger.error("No target chat ID provided for summary")
             return
             
-        logger.info(f"Starting summary creation for chat {target_chat_id}, days={days}")
+        logger.info("Starting summary creation for chat %s, days=%s", target_chat_id, days)
+        
+        # Make sure queued messages are in DB before reading them
+        await self.flush_message_buffer()
         
         # Get unsummarized messages
-        db = get_session()
         try:
             # Get messages from the last N days that haven't been summarized
-            # TODO: Implement a more efficient date-based query
-            messages = crud.get_unsummarized_messages(db, target_chat_id, limit=1000)
+            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+            messages = await run_db(crud.get_unsummarized_messages, target_chat_id, limit=1000, since=cutoff_date)
             
             if not messages or len(messages) < MIN_MESSAGES:
-                logger.info(f"Not enough messages to create summary for {target_chat_id}: {len(messages) if messages else 0}/{MIN_MESSAGES}")
+                logger.info("Not enough messages to create summary for %s: %s/%s", target_chat_id, len(messages) if messages else 0, MIN_MESSAGES)
                 return
-                
-            # Cut to the last N days
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-            messages = [msg for msg in messages if msg.date_ts >= cutoff_date]
             
             # Filter for messages with meaningful content (text or caption)
             text_messages = [msg for msg in messages if msg.text or msg.caption]
             
             if not text_messages or len(text_messages) < MIN_MESSAGES:
-                logger.info(f"Not enough text messages to create summary: {len(text_messages) if text_messages else 0}/{MIN_MESSAGES}")
+                logger.info("Not enough text messages to create summary: %s/%s", len(text_messages) if text_messages else 0, MIN_MESSAGES)
                 return
                 
             # Create summary
@@ -300,8 +462,8 @@ class ChatSummarizerBot:
             # Save summary to DB
             # first_msg_id = messages[0].internal_id if messages else None
             # last_msg_id = messages[-1].internal_id if messages else None
-            # summary = crud.create_summary(
-            #     db, 
+            # summary = await run_db(
+            #     crud.create_summary,
             #     chat_id=target_chat_id, 
             #     text=summary_text, 
             #     message_count=len(messages),
@@ -311,21 +473,33 @@ class ChatSummarizerBot:
             
             # Mark messages as summarized
             # if messages:
-            #     crud.mark_messages_as_summarized(db, [msg.internal_id for msg in messages])
+            #     await run_db(crud.mark_messages_as_summarized, [msg.internal_id for msg in messages])
             
             # Send summary to the channel or specified chat
-            await context.bot.send_message(
-                chat_id=self.channel_id,  # Send to channel_id always
-                text=summary_text,
-                parse_mode=ParseMode.HTML
-            )
+            await self.send_to_channel(context.bot, summary_text, parse_mode=ParseMode.HTML)
             
-            logger.info(f"Summary created and sent for {target_chat_id}")
+            logger.info("Summary created and sent for %s", target_chat_id)
         except Exception as e:
-            logger.error(f"Error creating summary: {e}")
-        finally:
-            db.close()
+            logger.error("Error creating summary: %s", e)
     
+    async def send_to_channel(self, bot: Bot, text: str, **kwargs) -> Message:
+        """
+        Posts to channel_id, waiting out flood control up to SEND_MAX_RETRIES times.
+        Text over Telegram's length limit is sent as several consecutive messages; the last one is returned.
+        """
+        async with self._send_lock:
+            for part in split_message(text):
+                for attempt in range(SEND_MAX_RETRIES + 1):
+                    try:
+                        sent = await bot.send_message(chat_id=self.channel_id, text=part, **kwargs)
+                        break
+                    except RetryAfter as e:
+                        if attempt == SEND_MAX_RETRIES:
+                            raise
+                        logger.warning("Flood control on channel %s, retrying in %ss", self.channel_id, e.retry_after)
+                        await asyncio.sleep(e.retry_after)
+            return sent
+
     def run(self):
         """Starts the bot."""
         self.app.run_polling()
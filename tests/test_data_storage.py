@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import data_storage
+
+
+class BatchWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.writer = data_storage._BatchWriter()
+        self.addCleanup(self.writer.close)
+        patches = [
+            mock.patch.object(data_storage, "DATA_DIR", self.tmp.name),
+            mock.patch.object(data_storage, "FLUSH_INTERVAL", 0.1),
+            mock.patch.object(data_storage, "_writer", self.writer),
+            mock.patch.object(data_storage, "_daily_paths", {}),
+            mock.patch.object(data_storage, "_CREATED_DIRS", set()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _read_records(self, subdir):
+        directory = os.path.join(self.tmp.name, subdir)
+        records = []
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+    def test_single_record_is_flushed_without_further_writes(self):
+        data_storage.save_raw_update({"update_id": 1, "text": "привет"})
+
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            path = os.path.join(self.tmp.name, "raw_updates")
+            if os.path.isdir(path) and any(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path)):
+                break
+            time.sleep(0.05)
+
+        records = self._read_records("raw_updates")
+        self.assertEqual([r["data"] for r in records], [{"update_id": 1, "text": "привет"}])
+
+    def test_close_writes_pending_records(self):
+        data_storage.save_update("message", {"update_id": 2}, {"message_id": 5})
+        self.writer.close()
+
+        self.assertEqual([r["data"] for r in self._read_records("raw_updates")], [{"update_id": 2}])
+        self.assertEqual([r["data"] for r in self._read_records("message")], [{"message_id": 5}])
+
+
+if __name__ == "__main__":
+    unittest.main()
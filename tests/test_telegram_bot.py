@@ -0,0 +1,74 @@
+import re
+import unittest
+from html.parser import HTMLParser
+
+from telegram_bot import split_message
+
+LIMIT = 4096
+
+
+class _BalanceChecker(HTMLParser):
+    """Collects the text of a part and fails on unbalanced tags."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            raise AssertionError(f"unbalanced </{tag}>")
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_entityref(self, name):
+        self.text.append(f"&{name};")
+
+
+def _check_part(part):
+    checker = _BalanceChecker()
+    checker.feed(part)
+    checker.close()
+    if checker.stack:
+        raise AssertionError(f"unclosed tags {checker.stack}")
+    return "".join(checker.text)
+
+
+def _plain_text(text):
+    return re.sub(r"<[^>]*>", "", text)
+
+
+class SplitMessageTest(unittest.TestCase):
+    def assert_valid_split(self, text, parts):
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertLessEqual(len(part), LIMIT)
+        self.assertEqual("".join(_check_part(part) for part in parts), _plain_text(text))
+
+    def test_short_text_is_not_split(self):
+        self.assertEqual(split_message("<b>hi</b>"), ["<b>hi</b>"])
+
+    def test_tag_crossing_boundary_is_closed_and_reopened(self):
+        text = "a" * 4000 + "\n<b>" + "bold line\n" * 30 + "</b> tail &amp; more"
+        parts = split_message(text)
+
+        self.assert_valid_split(text, parts)
+        self.assertTrue(parts[0].endswith("</b>"))
+        self.assertTrue(parts[1].startswith("<b>"))
+
+    def test_long_line_inside_link_keeps_entities_whole(self):
+        text = '<a href="https://example.com">' + "x &lt; y " * 1000 + "</a>"
+        parts = split_message(text)
+
+        self.assert_valid_split(text, parts)
+        for part in parts:
+            self.assertTrue(part.startswith('<a href="https://example.com">'))
+            self.assertNotRegex(part, r"&[a-z]*(?![a-z;])")  # No cut entities such as "&l"
+
+
+if __name__ == "__main__":
+    unittest.main()
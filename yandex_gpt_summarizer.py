@@ -2,12 +2,17 @@ import logging
 import json
 import requests
 import time
+import random
 from collections import Counter
 import re
-from config import YANDEX_GPT_API_KEY, YANDEX_GPT_API_URL, YANDEX_GPT_MODEL, RETRY_ATTEMPTS, RETRY_DELAY
+from config import (YANDEX_GPT_API_KEY, YANDEX_GPT_API_URL, YANDEX_GPT_MODEL,
+                    RETRY_ATTEMPTS, RETRY_DELAY, RETRY_MAX_DELAY)
 
 logger = logging.getLogger(__name__)
 
+# HTTP-статусы временных ошибок, при которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
 class YandexGPTSummarizer:
     """Класс для создания саммари сообщений с использованием Yandex GPT"""
     
@@ -34,19 +39,24 @@ class YandexGPTSummarizer:
             str: Подготовленный текст сообщений
         """
         # Проверяем, что все сообщения из одного чата
-        chat_ids = set(message.chat_id for message in messages)
+        chat_ids = {message.chat_id for message in messages}
         if len(chat_ids) > 1:
             logger.warning(f"Подготовка сообщений из разных чатов! {chat_ids}")
         
         prepared_text = []
         for message in messages:
-            name = message.first_name
-            if message.last_name:
-                name += f" {message.last_name}"
+            content = message.text or message.caption
+            # Стикеры и медиа без подписи не несут текста для анализа
+            if not content:
+                continue
+            user = message.user
+            name = user.first_name or user.username or str(user.user_id)
+            if user.last_name:
+                name += f" {user.last_name}"
             
             # Формат: [Время] Имя: Текст
-            time_str = message.date.strftime("%H:%M:%S")
-            prepared_text.append(f"[{time_str}] {name}: {message.text}")
+            time_str = message.date_ts.strftime("%H:%M:%S")
+            prepared_text.append(f"[{time_str}] {name}: {content}")
         
         return "\n".join(prepared_text)
     
@@ -60,24 +70,24 @@ class YandexGPTSummarizer:
         Returns:
             str: Ответ от API
         """
-        for attempt in range(RETRY_ATTEMPTS):
-            try:
-                payload = {
-                    "model": YANDEX_GPT_MODEL,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "text": "Ты - аналитик чатов. Твоя задача - создать краткое саммари сообщений из группового чата. Включи в саммари: 1) Основные темы обсуждения, 2) Ключевые выводы или решения, 3) Самые активные дискуссии. Формат ответа должен быть в Markdown."
-                        },
-                        {
-                            "role": "user",
-                            "text": f"Проанализируй следующие сообщения из группового чата и создай краткое саммари:\n\n{prompt}"
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 800
+        payload = {
+            "model": YANDEX_GPT_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "text": "Ты - аналитик чатов. Твоя задача - создать краткое саммари сообщений из группового чата. Включи в саммари: 1) Основные темы обсуждения, 2) Ключевые выводы или решения, 3) Самые активные дискуссии. Формат ответа должен быть в Markdown."
+                },
+                {
+                    "role": "user",
+                    "text": f"Проанализируй следующие сообщения из группового чата и создай краткое саммари:\n\n{prompt}"
                 }
+            ],
+            "temperature": 0.7,
+            "max_tokens": 800
+        }
 
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
                 response = requests.post(YANDEX_GPT_API_URL, headers=self.headers, json=payload, timeout=30)
                 response.raise_for_status()
 
@@ -86,25 +96,37 @@ class YandexGPTSummarizer:
                     return result["result"]["alternatives"][0]["message"]["text"]
                 else:
                     logger.error(f"Неожиданный формат ответа от Yandex GPT: {result}")
-
-                    if attempt < RETRY_ATTEMPTS - 1:
-                        logger.info(f"Повторная попытка {attempt+1}/{RETRY_ATTEMPTS} через {RETRY_DELAY} секунд...")
-                        time.sleep(RETRY_DELAY)
-                    else:
-                        return None
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Ошибка при вызове Yandex GPT API (попытка {attempt+1}/{RETRY_ATTEMPTS}): {str(e)}")
-
-                if attempt < RETRY_ATTEMPTS - 1:
-                    logger.info(f"Повторная попытка через {RETRY_DELAY} секунд...")
-                    time.sleep(RETRY_DELAY)
-                else:
+            except requests.exceptions.HTTPError as e:
+                status_code = e.response.status_code if e.response is not None else None
+                logger.error(f"Ошибка HTTP {status_code} при вызове Yandex GPT API (попытка {attempt+1}/{RETRY_ATTEMPTS}): {str(e)}")
+                # Ошибки запроса (4xx, кроме 429) не исправятся повтором
+                if status_code not in RETRYABLE_STATUS_CODES:
                     return None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                logger.error(f"Ошибка при вызове Yandex GPT API (попытка {attempt+1}/{RETRY_ATTEMPTS}): {str(e)}")
             except Exception as e:
                 logger.error(f"Неожиданная ошибка при вызове Yandex GPT API: {str(e)}")
                 return None
 
+            if attempt < RETRY_ATTEMPTS - 1:
+                delay = self._get_retry_delay(attempt)
+                logger.info(f"Повторная попытка {attempt+2}/{RETRY_ATTEMPTS} через {delay:.1f} секунд...")
+                time.sleep(delay)
+
         return None
+
+    @staticmethod
+    def _get_retry_delay(attempt):
+        """
+        Задержка перед повторной попыткой: экспоненциальный рост со случайным разбросом
+
+        Args:
+            attempt: Номер неудачной попытки, начиная с 0
+
+        Returns:
+            float: Задержка в секундах
+        """
+        return min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt) + random.uniform(0, RETRY_DELAY)
     
     def create_summary(self, messages):
         """
@@ -152,21 +174,29 @@ class YandexGPTSummarizer:
         if not messages:
             return "Нет данных для статистики."
 
-        # Подсчитываем количество сообщений по часам
+        # Считаем все показатели за один проход по сообщениям
         hour_counts = Counter()
+        senders = set()
+        questions_count = 0
+        media_count = 0
         for message in messages:
-            hour_counts[message.date.hour] += 1
+            hour_counts[message.date_ts.hour] += 1
+            senders.add(message.user_id)
+            questions_count += bool(message.is_question)
+            media_count += bool(message.has_media)
 
         # Находим самый активный час
-        most_active_hour = max(hour_counts.items(), key=lambda x: x[1])
+        most_active_hour, most_active_count = max(hour_counts.items(), key=lambda x: x[1])
 
         # Формируем статистику
-        stats = "*📊 Статистика чата:*\n"
-        stats += f"💬 Всего сообщений: {len(messages)}\n"
-        stats += f"👥 Уникальных отправителей: {len(set(m.id for m in messages))}\n"
-        stats += f"❓ Вопросов: {sum(1 for m in messages if m.is_question)}\n"
-        stats += f"📷 Медиа-сообщений: {sum(1 for m in messages if m.has_media)}\n"
-        stats += f"\n*Самый активный час:* {most_active_hour[0]}:00 ({most_active_hour[1]} сообщений)"
+        stats = (
+            "*📊 Статистика чата:*\n"
+            f"💬 Всего сообщений: {len(messages)}\n"
+            f"👥 Уникальных отправителей: {len(senders)}\n"
+            f"❓ Вопросов: {questions_count}\n"
+            f"📷 Медиа-сообщений: {media_count}\n"
+            f"\n*Самый активный час:* {most_active_hour}:00 ({most_active_count} сообщений)"
+        )
         
         return stats
     
@@ -182,7 +212,7 @@ class YandexGPTSummarizer:
             str: Текст саммари
         """
         # Анализ ключевых слов
-        all_text = " ".join([message.text for message in messages]).lower()
+        all_text = " ".join([message.text or message.caption or "" for message in messages]).lower()
         words = re.findall(r'\b[а-яёa-z]{4,}\b', all_text)
         words = [word for word in words if word not in self.stop_words]
         